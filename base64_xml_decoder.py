@@ -4,262 +4,1587 @@ import xml.etree.ElementTree as ET
 import sys
 import re
 import gzip
+import zipfile
 import chardet
 from datetime import datetime
 import json
+import codecs
+import argparse
+import hashlib
+import sqlite3
+import csv
+import tempfile
+import io
+import time
+import shlex
+import cProfile
+import contextlib
+import mmap
+import zlib
+import difflib
+from collections import Counter, OrderedDict, deque, namedtuple
+from operator import attrgetter
+from concurrent.futures import ProcessPoolExecutor
+from http.server import HTTPServer, BaseHTTPRequestHandler
+from urllib.parse import urlparse, parse_qs
+
+# Bump whenever the decoding rules change so cached xml-decoded files are rebuilt
+DECODER_VERSION = 2
+MANIFEST_FILENAME = ".manifest.json"
+DECODE_CACHE_FILENAME = ".decode-cache.json"
+SEARCH_INDEX_FILENAME = ".search-index.sqlite"
+
+GZIP_MAGIC = b'\x1f\x8b'
+# UTF-32 marks first: the UTF-32-LE mark starts with the UTF-16-LE one
+BYTE_ORDER_MARKS = [
+    (codecs.BOM_UTF32_LE, 'utf-32'),
+    (codecs.BOM_UTF32_BE, 'utf-32'),
+    (codecs.BOM_UTF8, 'utf-8-sig'),
+    (codecs.BOM_UTF16_LE, 'utf-16'),
+    (codecs.BOM_UTF16_BE, 'utf-16'),
+]
+# chardet is slow on large payloads, a prefix is enough to guess the charset
+CHARDET_SAMPLE_SIZE = 64 * 1024
+
+# Above this number of results, result.html is rendered page by page in the browser
+STATIC_TABLE_LIMIT = 1000
+
+# Port of the --serve search API and how often it checks ./xml for changes (seconds)
+SERVE_PORT = 8765
+WATCH_INTERVAL = 2.0
+
+# Number of values decoded through each path of decode_base64 (per process),
+# and by kind of encoded value under 'kind ...' keys
+DECODE_STATS = Counter()
+
+# Seconds spent in each stage of the work (per process)
+STAGE_TIMES = Counter()
+
+# Output levels of log(): QUIET only shows errors, warnings and where the results
+# are, VERBOSE also every processed file and every hit
+QUIET, NORMAL, VERBOSE = 0, 1, 2
+LOG_LEVEL = NORMAL
+# Minimum seconds between two updates of a progress line
+PROGRESS_INTERVAL = 0.2
+
+def log(message='', level=NORMAL):
+    """Print message if the output level allows it"""
+    if level <= LOG_LEVEL:
+        print(message)
+
+def configure_output(level):
+    """Set the output level and buffer stdout in blocks instead of lines.
+    
+    Progress lines and the --serve loop flush explicitly; everything else is
+    written when the buffer fills up or the program ends."""
+    global LOG_LEVEL
+    LOG_LEVEL = level
+    if hasattr(sys.stdout, 'reconfigure'):
+        sys.stdout.reconfigure(line_buffering=False)
+
+class Progress:
+    """Progress line of a long loop, updated in place on a terminal at NORMAL level"""
+    
+    def __init__(self, label, total):
+        self.label = label
+        self.total = total
+        self.done = 0
+        self.shown = 0.0
+        self.enabled = LOG_LEVEL == NORMAL and total > 1 and sys.stdout.isatty()
+    
+    def advance(self):
+        self.done += 1
+        if not self.enabled:
+            return
+        now = time.monotonic()
+        if now - self.shown >= PROGRESS_INTERVAL or self.done == self.total:
+            self.shown = now
+            sys.stdout.write(f"\r{self.label}: {self.done}/{self.total}")
+            if self.done == self.total:
+                sys.stdout.write("\n")
+            sys.stdout.flush()
+
+# Written with --profile next to result.html
+RUN_REPORT_FILENAME = "./run-report.json"
+
+@contextlib.contextmanager
+def timed(stage):
+    """Add the time spent in the with block to STAGE_TIMES[stage]"""
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        STAGE_TIMES[stage] += time.perf_counter() - start
+
+# Decoded characters kept by the decode cache of each process, least recently used evicted first
+DECODE_CACHE_MAX_CHARS = 32 * 1024 * 1024
+# Longer decoded payloads are not cached, so a few huge scripts cannot fill the cache
+DECODE_CACHE_MAX_LENGTH = 512 * 1024
+# Shorter payloads are decoded again: hashing them costs as much as decoding
+DECODE_CACHE_MIN_LENGTH = 64
+
+class DecodeCache:
+    """LRU cache of decoded base64 payloads keyed by the payload hash, bounded by decoded characters.
+    
+    The same email templates and scripts appear in many workflows, so identical
+    payloads are decoded once per process. An entry is (decoded text, decoding
+    paths), the paths being counted in DECODE_STATS again on every hit. When the
+    cache is persisted, the entries decoded since the last take_added() are
+    tracked so worker processes can send them back."""
+    
+    def __init__(self, max_chars=DECODE_CACHE_MAX_CHARS):
+        self.max_chars = max_chars
+        self.entries = OrderedDict()
+        self.chars = 0
+        self.added = None
+    
+    def get(self, key):
+        entry = self.entries.get(key)
+        if entry is None:
+            DECODE_STATS['cache miss'] += 1
+            return None
+        self.entries.move_to_end(key)
+        DECODE_STATS['cache hit'] += 1
+        return entry
+    
+    def put(self, key, entry):
+        if len(entry[0]) > DECODE_CACHE_MAX_LENGTH:
+            return
+        self.store(key, entry)
+        self.evict()
+        if self.added is not None:
+            self.added[key] = entry
+    
+    def store(self, key, entry):
+        old = self.entries.pop(key, None)
+        if old is not None:
+            self.chars -= len(old[0])
+        self.entries[key] = entry
+        self.chars += len(entry[0])
+    
+    def evict(self):
+        """Drop the least recently used entries until the cache fits in max_chars"""
+        while self.chars > self.max_chars:
+            _, entry = self.entries.popitem(last=False)
+            self.chars -= len(entry[0])
+    
+    def clear(self):
+        self.entries.clear()
+        self.chars = 0
+    
+    def merge(self, entries):
+        """Add entries decoded by another process"""
+        for key, entry in entries.items():
+            self.store(key, entry)
+        self.evict()
+    
+    def take_added(self):
+        """Return and forget the entries decoded since the last call"""
+        added = self.added or {}
+        if self.added is not None:
+            self.added = {}
+        return added
+    
+    def load(self, path):
+        """Load persisted entries (ignored if missing or from another decoder version)"""
+        self.added = {}
+        try:
+            with open(path, 'r', encoding='utf-8') as f:
+                data = json.load(f)
+        except FileNotFoundError:
+            return
+        except (ValueError, OSError) as e:
+            log(f"Error reading decode cache {path}: {e}", QUIET)
+            return
+        if data.get('version') != DECODER_VERSION:
+            return
+        try:
+            for key, decoded, paths in data.get('entries', []):
+                self.store(key, (decoded, tuple(paths)))
+        except (TypeError, ValueError) as e:
+            log(f"Error reading decode cache {path}: {e}", QUIET)
+            self.clear()
+        self.evict()
+    
+    def save(self, path):
+        """Persist the entries, least recently used first"""
+        with open(path, 'w', encoding='utf-8') as f:
+            json.dump({'version': DECODER_VERSION,
+                       'entries': [[key, decoded, paths] for key, (decoded, paths) in self.entries.items()]}, f)
+
+DECODE_CACHE = DecodeCache()
+
+# Base64 alphabet followed by the padding base64.b64decode(validate=True) accepts:
+# one or two '=' closing the last quantum, or whole '====' groups after it
+BASE64_VALUE_RE = re.compile(r'[A-Za-z0-9+/]+(?:={1,2}|(?:====)*)')
 
 def is_base64(s):
-    """Check if a string is likely base64 encoded"""
-    if isinstance(s, str):
-        # Check if string looks like base64 (alphanumeric + /=)
-        if re.match(r'^[A-Za-z0-9+/=]+$', s):
-            # Additional length check - base64 strings are typically multiples of 4
-            if len(s) % 4 == 0:
-                # Skip short alphabetic words like "Done", "Test", etc.
-                if len(s) <= 8 and s.isalpha():
-                    return False
-                    
-                try:
-                    # Try to decode and catch exceptions
-                    base64.b64decode(s, validate=True)
-                    return True
-                except:
-                    return False
+    """Check if a string is likely base64 encoded.
+    
+    The check is purely syntactic: a string of the base64 alphabet whose length
+    is a multiple of 4 always decodes, so no trial decode is needed and the
+    value is decoded only once, by decode_base64."""
+    if isinstance(s, str) and s:
+        # Cheapest test first - base64 strings are multiples of 4
+        if len(s) % 4 == 0:
+            # Skip short alphabetic words like "Done", "Test", etc.
+            if len(s) <= 8 and s.isalpha():
+                return False
+            return BASE64_VALUE_RE.fullmatch(s) is not None
     return False
 
 def decode_base64(encoded_string):
-    """Decode a base64 string with multiple fallbacks"""
+    """Decode a base64 string, reusing the result of identical payloads"""
+    if len(encoded_string) < DECODE_CACHE_MIN_LENGTH:
+        return decode_base64_payload(encoded_string)
+    
+    key = hashlib.sha1(encoded_string.encode('utf-8')).hexdigest()
+    entry = DECODE_CACHE.get(key)
+    if entry is None:
+        paths = Counter()
+        entry = (decode_base64_payload(encoded_string, paths), tuple(paths.elements()))
+        DECODE_CACHE.put(key, entry)
+    DECODE_STATS.update(entry[1])
+    return entry[0]
+
+def decode_base64_payload(encoded_string, stats=None):
+    """Decode a base64 string, sniffing gzip and BOM headers before the charset fallbacks.
+    
+    The decoding paths taken are counted in stats (DECODE_STATS by default)."""
+    if stats is None:
+        stats = DECODE_STATS
     try:
         decoded_bytes = base64.b64decode(encoded_string)
         
-        # First, try to decompress if it's gzipped
-        try:
-            decompressed = gzip.decompress(decoded_bytes)
-            decoded_bytes = decompressed
-        except:
-            pass  # Not gzipped, use original bytes
+        # Decompress only when the gzip magic header is present
+        if decoded_bytes[:2] == GZIP_MAGIC:
+            try:
+                decoded_bytes = gzip.decompress(decoded_bytes)
+                stats['gzip'] += 1
+            except Exception:
+                stats['gzip (invalid, kept compressed)'] += 1
         
-        # Try to decode as UTF-8
+        # A byte order mark gives the encoding directly
+        for bom, encoding in BYTE_ORDER_MARKS:
+            if decoded_bytes.startswith(bom):
+                try:
+                    text = decoded_bytes.decode(encoding)
+                    stats['bom'] += 1
+                    return text
+                except UnicodeDecodeError:
+                    break
+        
+        # Plain UTF-8 is the typical Jira case (Groovy scripts, HTML email templates)
         try:
-            return decoded_bytes.decode('utf-8')
+            text = decoded_bytes.decode('utf-8')
+            stats['utf-8'] += 1
+            return text
         except UnicodeDecodeError:
             pass
         
-        # Try to detect encoding
+        # Try to detect encoding on a sample of the payload
         try:
-            result = chardet.detect(decoded_bytes)
+            result = chardet.detect(decoded_bytes[:CHARDET_SAMPLE_SIZE])
             if result['encoding']:
-                return decoded_bytes.decode(result['encoding'])
-        except:
+                text = decoded_bytes.decode(result['encoding'])
+                stats['chardet'] += 1
+                return text
+        except (UnicodeDecodeError, LookupError):
             pass
         
         # Try common encodings
         encodings = ['latin-1', 'windows-1252', 'iso-8859-1', 'utf-16']
         for encoding in encodings:
             try:
-                return decoded_bytes.decode(encoding)
-            except:
+                text = decoded_bytes.decode(encoding)
+                stats[f'fallback {encoding}'] += 1
+                return text
+            except UnicodeDecodeError:
                 continue
         
         # If all else fails, return the original string
-        print(f"Warning: Could not decode base64 string, keeping original")
+        stats['undecodable'] += 1
+        log(f"Warning: Could not decode base64 string, keeping original", QUIET)
         return encoded_string
         
     except Exception as e:
-        print(f"Error decoding base64: {e}")
+        stats['error'] += 1
+        log(f"Error decoding base64: {e}", QUIET)
         return encoded_string
 
-def contains_base64_pattern(text):
-    """Check if text contains embedded base64 patterns"""
-    # Look for common base64 patterns in Jira XML
-    patterns = [
-        r'`!`[A-Za-z0-9+/=]+`!`',  # Pattern like `!`base64content`!`
-        r'YCFg[A-Za-z0-9+/=]+',    # Pattern starting with YCFg
-    ]
-    
-    for pattern in patterns:
-        if re.search(pattern, text):
-            return True
-    return False
+# Embedded base64 patterns in Jira XML: `!`base64`!` and YCFg followed by base64
+# ("YCFg" is "`!`" base64 encoded), matched by a single alternation
+EMBEDDED_BASE64_RE = re.compile(r'`!`([A-Za-z0-9+/=]+)`!`|YCFg([A-Za-z0-9+/=]+)')
+YCFG_BASE64_RE = re.compile(r'YCFg([A-Za-z0-9+/=]+)')
 
-def extract_and_decode_patterns(text):
-    """Extract and decode embedded base64 patterns in text"""
-    # Pattern for `!`base64`!`
-    pattern1 = r'`!`([A-Za-z0-9+/=]+)`!`'
+def decode_embedded_match(match):
+    """Decode one match of EMBEDDED_BASE64_RE"""
+    encoded = match.group(1)
+    if encoded is None:
+        DECODE_STATS['kind YCFg pattern'] += 1
+        return decode_base64(match.group(2))
     
-    def replace_pattern1(match):
-        encoded = match.group(1)
-        decoded = decode_base64(encoded)
-        return decoded
-    
-    text = re.sub(pattern1, replace_pattern1, text)
-    
-    # Pattern for YCFg followed by base64
-    pattern2 = r'YCFg([A-Za-z0-9+/=]+)'
+    DECODE_STATS['kind `!` pattern'] += 1
+    decoded = decode_base64(encoded)
+    # A decoded `!` payload can itself carry YCFg patterns
+    if 'YCFg' in decoded:
+        decoded = YCFG_BASE64_RE.sub(lambda m: decode_base64(m.group(1)), decoded)
+    return decoded
+
+def decode_embedded_patterns(text):
+    """Decode the embedded base64 patterns of text in a single pass.
     
-    def replace_pattern2(match):
-        encoded = match.group(1)
-        decoded = decode_base64(encoded)
+    Returns None when text contains no pattern."""
+    # Most values contain neither marker: skip the regex entirely
+    if '`!`' not in text and 'YCFg' not in text:
+        return None
+    decoded, count = EMBEDDED_BASE64_RE.subn(decode_embedded_match, text)
+    return decoded if count else None
+
+def decode_value(value):
+    """Decode a text or attribute value, returning None if it contains no base64"""
+    # Check for embedded base64 patterns
+    decoded = decode_embedded_patterns(value)
+    if decoded is not None:
         return decoded
-    
-    text = re.sub(pattern2, replace_pattern2, text)
-    
-    return text
+    # Check if entire value is base64
+    if is_base64(value):
+        DECODE_STATS['kind whole value'] += 1
+        return decode_base64(value)
+    return None
 
-def process_xml_element(elem):
-    """Recursively process XML elements and decode base64 values"""
+def decode_element(elem, skip=(), found=None):
+    """Decode base64 values in the text and attributes of a single element.
+    
+    Attributes named in skip are left as they are (already decoded). The
+    decoded values are appended to found (if given) as (attribute name, value),
+    the attribute name being None for the element text."""
     # Check element text
     if elem.text and elem.text.strip():
-        text = elem.text.strip()
-        
-        # Check for embedded base64 patterns
-        if contains_base64_pattern(text):
-            elem.text = extract_and_decode_patterns(text)
-        # Check if entire text is base64
-        elif is_base64(text):
-            elem.text = decode_base64(text)
+        decoded = decode_value(elem.text.strip())
+        if decoded is not None:
+            elem.text = decoded
+            if found is not None:
+                found.append((None, decoded))
     
     # Check element attributes
     for attr_name, attr_value in elem.attrib.items():
-        if contains_base64_pattern(attr_value):
-            elem.attrib[attr_name] = extract_and_decode_patterns(attr_value)
-        elif is_base64(attr_value):
-            elem.attrib[attr_name] = decode_base64(attr_value)
+        if attr_name in skip:
+            continue
+        decoded = decode_value(attr_value)
+        if decoded is not None:
+            elem.attrib[attr_name] = decoded
+            if found is not None:
+                found.append((attr_name, decoded))
+
+# Attributes element_context and context_result read
+CONTEXT_ATTRIBUTES = ('name', 'id', 'type', 'class')
+
+def decode_attributes(elem, names):
+    """Decode base64 values in the given attributes of a single element"""
+    for attr_name in names:
+        attr_value = elem.get(attr_name)
+        if attr_value is not None:
+            decoded = decode_value(attr_value)
+            if decoded is not None:
+                elem.set(attr_name, decoded)
+
+def process_xml_element(elem):
+    """Process an XML element and all its descendants and decode base64 values"""
+    # Element.iter walks the subtree without Python recursion, whatever its depth
+    for current in elem.iter():
+        decode_element(current)
+
+# Inputs read from ./xml: XML files, gzip'd XML files and zip archives of either
+XML_SUFFIXES = ('.xml', '.xml.gz')
+ARCHIVE_SUFFIX = '.zip'
+# Errors of an input that cannot be read (missing, truncated or corrupt archive)
+INPUT_ERRORS = (OSError, EOFError, zipfile.BadZipFile)
+# Archive member names that would resolve outside the output folder: absolute
+# paths, drive letters and .. components
+UNSAFE_MEMBER_RE = re.compile(r'^[/\\]|^[A-Za-z]:|(^|[/\\])\.\.([/\\]|$)')
+
+def list_inputs(input_dir):
+    """Return {name: (path, member, size, mtime_ns)} for the exports of input_dir and its subfolders and archives"""
+    # A name is the path relative to input_dir with '/' separators (backup.zip/exports/WF.xml),
+    # member is None outside archives
+    inputs = {}
+    for dirpath, dirnames, filenames in os.walk(input_dir):
+        dirnames.sort()
+        for filename in filenames:
+            path = os.path.join(dirpath, filename)
+            name = os.path.relpath(path, input_dir).replace(os.sep, '/')
+            if filename.endswith(XML_SUFFIXES):
+                stat = os.stat(path)
+                inputs[name] = (path, None, stat.st_size, stat.st_mtime_ns)
+            elif filename.endswith(ARCHIVE_SUFFIX):
+                try:
+                    with zipfile.ZipFile(path) as archive:
+                        for info in archive.infolist():
+                            if info.is_dir() or not info.filename.endswith(XML_SUFFIXES):
+                                continue
+                            if UNSAFE_MEMBER_RE.search(info.filename):
+                                log(f"Error reading {path}/{info.filename}: unsafe member name, skipped", QUIET)
+                                continue
+                            # Size and date of a member as recorded in its archive
+                            mtime_ns = int(time.mktime(info.date_time + (0, 0, -1))) * 1000000000
+                            inputs[f"{name}/{info.filename}"] = (path, info.filename, info.file_size, mtime_ns)
+                except INPUT_ERRORS as e:
+                    log(f"Error reading {path}: {e}", QUIET)
+    return dict(sorted(inputs.items()))
+
+def input_label(source):
+    """Return the path of an input as shown in messages"""
+    path, member = source[:2]
+    return path if member is None else f"{path}/{member}"
+
+@contextlib.contextmanager
+def open_input(source):
+    """Open an input as a binary stream of its XML, straight from its archive and decompressed on the fly"""
+    path, member = source[:2]
+    with contextlib.ExitStack() as stack:
+        if member is None:
+            f = stack.enter_context(open(path, 'rb'))
+        else:
+            archive = stack.enter_context(zipfile.ZipFile(path))
+            f = stack.enter_context(archive.open(member))
+        if (member or path).endswith('.gz'):
+            f = stack.enter_context(gzip.GzipFile(fileobj=f))
+        yield f
+
+class HashingReader:
+    """Binary stream computing the SHA-256 of the data read through it.
     
-    # Recursively process child elements
-    for child in elem:
-        process_xml_element(child)
+    Used to hash an input for the manifest while it is parsed, so each input
+    is read once."""
+    
+    def __init__(self, f):
+        self.f = f
+        self.digest = hashlib.sha256()
+    
+    def read(self, size=-1):
+        data = self.f.read(size)
+        self.digest.update(data)
+        return data
+    
+    def hexdigest(self):
+        return self.digest.hexdigest()
 
-def process_xml_file(input_path, output_path):
-    """Process a single XML file and decode base64 values"""
-    try:
-        # Parse XML file
+def output_path_of(output_dir, name):
+    """Return the output path of an input, mirroring the subfolders and archives of ./xml"""
+    # The .gz suffix is kept: A.xml.gz is decoded to A.xml-decoded.xml, next to the A-decoded.xml of an A.xml
+    output_path = os.path.join(output_dir, *name.split('/'))
+    if not is_inside(output_path, output_dir):
+        raise ValueError(f"{name} would be written outside {output_dir}")
+    return output_path
+
+def is_inside(path, folder):
+    """Return True if path resolves (symbolic links included) to folder or a path under it"""
+    folder = os.path.realpath(folder)
+    return os.path.commonpath([os.path.realpath(path), folder]) == folder
+
+def get_decoded_path(output_path):
+    """Return the path of the decoded file (with "-decoded" suffix) for an output path"""
+    base_name = os.path.splitext(os.path.basename(output_path))[0]
+    output_dir = os.path.dirname(output_path)
+    return os.path.join(output_dir, f"{base_name}-decoded.xml")
+
+def decode_xml_file(input_path, output_path, payloads=None):
+    """Decode a single XML file (a path or a binary stream) and write it next to output_path, raising on errors.
+    
+    The decoded payloads are recorded in payloads (a PayloadCollector) if given."""
+    # Parse XML file
+    with timed('parse'):
         tree = ET.parse(input_path)
-        root = tree.getroot()
-        
-        # Process all elements
-        process_xml_element(root)
-        
-        # Add "-decoded" to filename
-        base_name = os.path.splitext(os.path.basename(output_path))[0]
-        output_dir = os.path.dirname(output_path)
-        new_output_path = os.path.join(output_dir, f"{base_name}-decoded.xml")
-        
-        # Write the modified XML to output file
+    root = tree.getroot()
+    
+    # Process all elements
+    with timed('decode'):
+        if payloads is None:
+            process_xml_element(root)
+        else:
+            payloads.decode_tree(tree)
+    
+    # Add "-decoded" to filename
+    new_output_path = get_decoded_path(output_path)
+    
+    # Write the modified XML to output file
+    with timed('write'):
         tree.write(new_output_path, encoding='UTF-8', xml_declaration=True)
-        print(f"Processed: {input_path} -> {new_output_path}")
-        
-        return tree
-        
+    return tree
+
+# Decoded payloads shorter than this are left out of the duplicates report (names, ids, flags)
+PAYLOAD_MIN_LENGTH = 50
+# Characters of a payload shown in the duplicates report, whitespace collapsed
+PAYLOAD_PREVIEW_LENGTH = 120
+# Near-duplicate payloads are found with MinHash signatures over the shingles
+# (runs of SHINGLE_TOKENS tokens) of each payload, cut in bands of
+# MINHASH_BAND_ROWS values for locality-sensitive hashing
+SHINGLE_TOKENS = 5
+MINHASH_SIZE = 64
+MINHASH_BAND_ROWS = 4
+# Hash (a * x + b) mod MINHASH_PRIME of the shingles, fixed so that the
+# signatures of different worker processes and runs can be compared
+MINHASH_PRIME = (1 << 61) - 1
+MINHASH_A = 0x1d3a5b7c9e0f2468
+MINHASH_B = 0x0badc0ffee15dead
+PAYLOAD_TOKEN_RE = re.compile(r'\w+|[^\w\s]')
+# Bins an empty bin borrows its value from, first non-empty one in a fixed
+# pseudo-random order of its own
+MINHASH_PROBES = [sorted(range(MINHASH_SIZE), key=lambda other: zlib.crc32(f"{slot}:{other}".encode('ascii')))
+                  for slot in range(MINHASH_SIZE)]
+
+def payload_signature(text):
+    """Return the MinHash signature of a payload.
+    
+    One-permutation MinHash: each shingle is hashed once into one of
+    MINHASH_SIZE bins, and the signature is the minimum of each bin, an empty
+    bin borrowing the value of another bin (see MINHASH_PROBES). Two signatures
+    agree on about as many values as the share of shingles their payloads have
+    in common (see signature_similarity)."""
+    tokens = PAYLOAD_TOKEN_RE.findall(text)
+    bins = [None] * MINHASH_SIZE
+    for start in range(max(1, len(tokens) - SHINGLE_TOKENS + 1)):
+        shingle = zlib.crc32('\x1f'.join(tokens[start:start + SHINGLE_TOKENS]).encode('utf-8', 'surrogatepass'))
+        value = (MINHASH_A * shingle + MINHASH_B) % MINHASH_PRIME
+        slot = value % MINHASH_SIZE
+        if bins[slot] is None or value < bins[slot]:
+            bins[slot] = value
+    
+    signature = []
+    for slot, value in enumerate(bins):
+        if value is None:
+            # Borrowed values never equal a value of the bin itself
+            attempt, other = next((attempt, other) for attempt, other in enumerate(MINHASH_PROBES[slot])
+                                  if bins[other] is not None)
+            value = bins[other] + (attempt + 1) * MINHASH_PRIME
+        signature.append(value)
+    return tuple(signature)
+
+def signature_similarity(signature, other):
+    """Return the estimated share of shingles two payloads have in common, from their signatures"""
+    return sum(value == other_value for value, other_value in zip(signature, other)) / len(signature)
+
+# Signatures already computed in this process, by payload SHA-1
+PAYLOAD_SIGNATURES = {}
+
+class PayloadCollector:
+    """Records the payloads decoded in one file for the duplicates report.
+    
+    Payloads are hashed (and, with near, given a MinHash signature) by the
+    process decoding the file, so only these records are sent back. A record
+    is (sha1, length, preview, signature or None, workflow, transition,
+    function_id, type, line)."""
+    
+    def __init__(self, filename, near=False):
+        self.workflow_name = workflow_name_of(filename)
+        self.near = near
+        self.records = []
+        # Values decoded in the current element, as (attribute name, value)
+        self.found = []
+    
+    def decode_element(self, elem):
+        """Decode an element like decode_element, keeping its decoded values for collect"""
+        decode_element(elem, found=self.found)
+    
+    def collect(self, elem, path, context):
+        """Record the values decoded in elem, now that its path and Jira context are known"""
+        if not self.found:
+            return
+        element_context_result = context_result(elem, context, self.workflow_name)
+        for attr_name, value in self.found:
+            if len(value) < PAYLOAD_MIN_LENGTH:
+                continue
+            digest = hashlib.sha1(value.encode('utf-8', 'surrogatepass')).hexdigest()
+            signature = None
+            if self.near:
+                signature = PAYLOAD_SIGNATURES.get(digest)
+                if signature is None:
+                    signature = PAYLOAD_SIGNATURES[digest] = payload_signature(value)
+            self.records.append((
+                digest, len(value), ' '.join(value.split())[:PAYLOAD_PREVIEW_LENGTH], signature,
+                element_context_result['workflow'], element_context_result['transition'],
+                element_context_result['function_id'], element_context_result['type'],
+                f"{path}/@{attr_name}" if attr_name else path))
+        self.found.clear()
+    
+    def decode_tree(self, tree):
+        """Decode a whole tree in document order, like process_xml_element, recording its payloads"""
+        for elem, path, context in iter_elements_with_context(tree, prepare=self.decode_element):
+            self.collect(elem, path, context)
+
+def decode_worker(task):
+    """Decode one task of decode_inputs in a worker process and return its outcome"""
+    filename, source, output_path, search_term, stream, index, duplicates = task
+    DECODE_STATS.clear()
+    STAGE_TIMES.clear()
+    # results: stream mode only; index: search index entries; payloads: PayloadCollector records.
+    # The decoded tree is not sent back, re-parsing the written file is cheaper than pickling it
+    outcome = {'error': None, 'sha256': None, 'results': None, 'index': [] if index else None, 'payloads': None}
+    payloads = PayloadCollector(filename, near=duplicates == 'near') if duplicates else None
+    try:
+        with open_input(source) as f:
+            reader = HashingReader(f)
+            if stream:
+                with timed('stream'):
+                    outcome['results'] = stream_xml_file(reader, get_decoded_path(output_path), search_term,
+                                                         filename, index_entries=outcome['index'],
+                                                         payloads=payloads)
+            else:
+                tree = decode_xml_file(reader, output_path, payloads)
+            outcome['sha256'] = reader.hexdigest()
+        if index and not stream:
+            with timed('index'):
+                outcome['index'] = collect_index_entries(tree, filename)
+        if payloads is not None:
+            outcome['payloads'] = payloads.records
     except Exception as e:
-        print(f"Error processing {input_path}: {e}")
-        return None
+        outcome['error'] = str(e)
+        outcome['index'] = None
+    outcome['stats'] = dict(DECODE_STATS)
+    outcome['times'] = dict(STAGE_TIMES)
+    outcome['cache'] = DECODE_CACHE.take_added()
+    return outcome
+
+def init_decode_worker(cache_path):
+    """Initialize a worker process, loading the persisted decode cache if any"""
+    if cache_path:
+        DECODE_CACHE.load(cache_path)
 
-def extract_jira_context_from_path(tree, elem, parent_map, filename):
-    """Extract Jira-specific context from XML element using parent map"""
-    # Use filename (without extension) as workflow name
-    workflow_name = os.path.splitext(os.path.basename(filename))[0]
+def decode_files(tasks, jobs, cache_path=None):
+    """Run decode_worker tasks, in parallel when jobs > 1.
+    
+    Yields (task, outcome) in task order so the output is deterministic
+    whatever the number of jobs. Worker processes load the decode cache
+    persisted at cache_path."""
+    if jobs <= 1 or len(tasks) <= 1:
+        for task in tasks:
+            yield task, decode_worker(task)
+        return
     
-    result = {
+    with ProcessPoolExecutor(max_workers=min(jobs, len(tasks)),
+                             initializer=init_decode_worker, initargs=(cache_path,)) as executor:
+        yield from zip(tasks, executor.map(decode_worker, tasks))
+
+FUNCTION_TAGS = ('function', 'validator', 'condition', 'post-function')
+
+# Context of the parent of the root element
+ROOT_CONTEXT = (None, None, None)
+
+def element_context(elem, parent_context):
+    """Return the Jira context of an element from the context of its parent.
+    
+    The context is (outermost named action, nearest named step, outermost
+    function id), carried down the tree during traversal so the transition and
+    function of a hit are known in O(1). It gives the same result as walking
+    from the element up to the root: outer actions and functions override
+    inner ones, and a step only names the transition when no action does."""
+    action, step, function = parent_context
+    tag = elem.tag.lower()
+    
+    # Look for action (which contains transition in Jira)
+    if 'action' in tag:
+        if action is None:
+            # Get the transition name from the action, or its id
+            transition_name = elem.get('name')
+            if transition_name:
+                action = transition_name
+            elif elem.get('id'):
+                action = f"Action-{elem.get('id')}"
+    
+    # Look for function or post-function
+    elif any(func_type in tag for func_type in FUNCTION_TAGS):
+        if function is None:
+            # For Jira functions, check various attributes
+            func_type = elem.get('type') or elem.get('class') or elem.get('name')
+            if func_type:
+                function = func_type.split('.')[-1] if '.' in func_type else func_type
+            else:
+                function = elem.tag
+    
+    # Look for step (which might contain state info)
+    elif 'step' in tag:
+        step_name = elem.get('name')
+        if step_name:
+            step = f"Step: {step_name}"
+    
+    return action, step, function
+
+def context_result(elem, context, workflow_name):
+    """Build the Jira context dict of a hit on elem"""
+    action, step, function = context
+    return {
         'workflow': workflow_name,
-        'transition': 'N/A',
-        'function_id': 'N/A',
+        'transition': action or step or 'N/A',
+        'function_id': function if function is not None else 'N/A',
         'type': elem.attrib.get('name', elem.tag) if elem.tag == 'arg' else elem.tag
     }
+
+# Fields of a result, in the column order of result.csv
+RESULT_FIELDS = ('workflow', 'transition', 'function_id', 'type', 'line', 'filename', 'content', 'term',
+                 'count', 'occurrences')
+
+class SearchResult:
+    """A search hit, stored in slots instead of a dict per hit.
+    
+    The strings repeated from hit to hit (workflow, transition, function id,
+    type, XML path, filename and term) are interned, so the results of a broad
+    search share a single copy of each. count and occurrences stay None until
+    the hit is grouped by group_results."""
+    __slots__ = RESULT_FIELDS
     
-    # Travel up the tree to find transition, function
-    current = elem
-    while current is not None:
-        tag = current.tag.lower()
+    def __init__(self, workflow, transition, function_id, type, line, filename, content, term,
+                 count=None, occurrences=None):
+        self.workflow = sys.intern(workflow)
+        self.transition = sys.intern(transition)
+        self.function_id = sys.intern(function_id)
+        self.type = sys.intern(type)
+        self.line = sys.intern(line)
+        self.filename = sys.intern(filename)
+        self.content = content
+        self.term = sys.intern(term)
+        self.count = count
+        self.occurrences = occurrences
+    
+    @classmethod
+    def from_context(cls, context, line, filename, content, term):
+        """Build the result of a hit from the context dict of its element (see context_result)"""
+        return cls(context['workflow'], context['transition'], context['function_id'], context['type'],
+                   line, filename, content, term)
+    
+    @classmethod
+    def from_dict(cls, data):
+        return cls(**data)
+    
+    def as_dict(self):
+        """Return the result as a dict of RESULT_FIELDS (without count and occurrences if not grouped)"""
+        result = {
+            'workflow': self.workflow,
+            'transition': self.transition,
+            'function_id': self.function_id,
+            'type': self.type,
+            'line': self.line,
+            'filename': self.filename,
+            'content': self.content,
+            'term': self.term
+        }
+        if self.count is not None:
+            result['count'] = self.count
+            result['occurrences'] = self.occurrences
+        return result
+    
+    def __repr__(self):
+        return f"SearchResult({self.as_dict()!r})"
+
+def workflow_name_of(filename):
+    """Use filename (without extension) as workflow name"""
+    base_name = os.path.basename(filename)
+    if base_name.endswith('.gz'):
+        base_name = base_name[:-3]
+    return os.path.splitext(base_name)[0]
+
+def matching_content(text, term):
+    """Return the content shown for a text hit: just the line containing the search term"""
+    stripped = text.strip()
+    term_lower = term.lower()
+    if '\n' in term_lower:
+        return stripped
+    
+    # The first occurrence of the term is in the first line containing it
+    lowered = stripped.lower()
+    position = lowered.find(term_lower)
+    if position < 0:
+        return stripped
+    return line_at(stripped, position)
+
+def line_at(stripped, position):
+    """Return the line of a stripped text containing position (the whole text if that line is blank)"""
+    line_number = stripped.count('\n', 0, position)
+    matching_line = stripped.split('\n', line_number + 1)[line_number].strip()
+    return matching_line if matching_line else stripped
+
+# Characters a term cannot have to be looked for in raw XML: they are escaped
+# in the file, or changed by the parser
+RAW_UNSAFE_CHARS = set('&<>"\'\r\n\t')
+
+def raw_term_pattern(terms):
+    """Return a bytes regex found in the raw XML of every value containing one of terms, or None.
+    
+    The regex is ASCII case-insensitive, and a space in a term also matches the
+    whitespace the parser turns into spaces in attribute values. None when a
+    term is not ASCII or has characters that XML escapes."""
+    alternatives = []
+    for term in terms:
+        if not term.isascii() or RAW_UNSAFE_CHARS & set(term):
+            return None
+        alternatives.append(rb'(?:\r\n|[ \t\r\n])'.join(re.escape(part.encode('ascii')) for part in term.split(' ')))
+    return re.compile(b'|'.join(alternatives), re.IGNORECASE)
+
+class MultiTermMatcher:
+    """Case-insensitive matcher finding which of many search terms occur in a text.
+    
+    The terms are compiled into an Aho-Corasick automaton so a value is scanned
+    once whatever the number of terms. Most values contain no term at all: they
+    are rejected first by a precompiled regex alternation, and the automaton
+    only runs on values containing at least one term."""
+    
+    # Every element is searched (see Query)
+    filtered = False
+    
+    def __init__(self, terms):
+        # Blank and duplicate terms are ignored, the order is kept
+        self.terms = [term for term in dict.fromkeys(terms) if term]
+        self.lowered = [term.lower() for term in self.terms]
+        self.prefilter = re.compile('|'.join(re.escape(term) for term in self.lowered))
         
-        # Look for action (which contains transition in Jira)
-        if 'action' in tag:
-            # Get the transition name from the action
-            transition_name = current.get('name')
-            if transition_name:
-                result['transition'] = transition_name
-            # Also check for id
-            elif current.get('id'):
-                result['transition'] = f"Action-{current.get('id')}"
+        # Trie of the lowered terms, then failure links in breadth-first order
+        self.goto = [{}]
+        self.fail = [0]
+        self.output = [[]]
+        for index, term in enumerate(self.lowered):
+            node = 0
+            for char in term:
+                next_node = self.goto[node].get(char)
+                if next_node is None:
+                    next_node = len(self.goto)
+                    self.goto.append({})
+                    self.fail.append(0)
+                    self.output.append([])
+                    self.goto[node][char] = next_node
+                node = next_node
+            self.output[node].append(index)
         
-        # Look for function or post-function
-        elif any(func_type in tag for func_type in ['function', 'validator', 'condition', 'post-function']):
-            # For Jira functions, check various attributes
-            func_type = current.get('type') or current.get('class') or current.get('name')
-            if func_type:
-                result['function_id'] = func_type.split('.')[-1] if '.' in func_type else func_type
-            else:
-                result['function_id'] = current.tag
+        queue = deque(self.goto[0].values())
+        while queue:
+            node = queue.popleft()
+            for char, next_node in self.goto[node].items():
+                queue.append(next_node)
+                fallback = self.fail[node]
+                while fallback and char not in self.goto[fallback]:
+                    fallback = self.fail[fallback]
+                self.fail[next_node] = self.goto[fallback].get(char, 0)
+                self.output[next_node] = self.output[next_node] + self.output[self.fail[next_node]]
+    
+    def find(self, text):
+        """Return the indexes of the terms found in text, in term order"""
+        text = text.lower()
+        if len(self.lowered) == 1:
+            return [0] if self.lowered[0] in text else []
+        if not self.prefilter.search(text):
+            return []
+        
+        found = set()
+        goto, fail, output = self.goto, self.fail, self.output
+        node = 0
+        for char in text:
+            while node and char not in goto[node]:
+                node = fail[node]
+            node = goto[node].get(char, 0)
+            if output[node]:
+                found.update(output[node])
+                if len(found) == len(self.terms):
+                    break
+        return sorted(found)
+    
+    def content_of(self, text, index):
+        """Return the content shown for a hit of term index in an element text"""
+        return matching_content(text, self.terms[index])
+    
+    def raw_pattern(self):
+        """Return a bytes regex found in the raw XML of every file with a hit, or None (see prescan_file)"""
+        return raw_term_pattern(self.terms)
+    
+    def fts_query(self):
+        """Return the full-text query selecting the index postings that may match, or None to scan them all.
         
-        # Look for step (which might contain state info)
-        elif 'step' in tag:
-            step_name = current.get('name')
-            if step_name and result['transition'] == 'N/A':
-                result['transition'] = f"Step: {step_name}"
+        Trigrams need 3 characters; non-ASCII terms may be case-folded
+        differently by SQLite and Python, so they scan all postings."""
+        if all(len(term) >= 3 and term.isascii() for term in self.terms):
+            return ' OR '.join('"' + term.replace('"', '""') + '"' for term in self.terms)
+        return None
+
+# Context fields a query can filter on
+QUERY_FIELDS = ('workflow', 'transition', 'function_id', 'type')
+
+class Query:
+    """A search query with regexes and filters on the Jira context of the hits.
+    
+    A query is a list of space separated conditions, all of which must hold
+    (use quotes for values with spaces):
+    
+        word            the value contains word (case-insensitive)
+        /regex/         the value matches regex (case-insensitive)
+        field:word      the field contains word
+        field:/regex/   the field matches regex
+    
+    where field is one of QUERY_FIELDS. A query with only field conditions
+    matches every non-blank value of the selected elements. The query text is
+    reported as the term of its results.
+    
+    The transition and function of an element are fixed as soon as an
+    enclosing action or function defines them, so prunes() lets traversals
+    skip whole subtrees that can no longer match."""
+    
+    filtered = True
+    
+    def __init__(self, text):
+        self.text = text
+        self.terms = [text]
+        self.patterns = []
+        # Words of the value conditions, used to narrow index searches
+        self.words = []
+        self.filters = {}
+        # Quotes group words, backslashes are kept for the regexes
+        lexer = shlex.shlex(text, posix=True)
+        lexer.whitespace_split = True
+        lexer.escape = ''
+        for token in lexer:
+            field, separator, value = token.partition(':')
+            if separator and field in QUERY_FIELDS:
+                self.filters[field] = self.compile(value)
+            else:
+                self.patterns.append(self.compile(token))
+                if not (len(token) > 1 and token.startswith('/') and token.endswith('/')):
+                    self.words.append(token)
+    
+    @staticmethod
+    def compile(value):
+        if len(value) > 1 and value.startswith('/') and value.endswith('/'):
+            return re.compile(value[1:-1], re.IGNORECASE)
+        return re.compile(re.escape(value), re.IGNORECASE)
+    
+    def find(self, text):
+        """Return [0] if the value conditions hold for text, [] otherwise"""
+        if not text.strip():
+            return []
+        for pattern in self.patterns:
+            if not pattern.search(text):
+                return []
+        return [0]
+    
+    def content_of(self, text, index):
+        """Return the line of an element text where the first value condition matches"""
+        stripped = text.strip()
+        if not self.patterns:
+            return stripped
+        match = self.patterns[0].search(stripped)
+        return line_at(stripped, match.start()) if match else stripped
+    
+    def matches_workflow(self, workflow_name):
+        pattern = self.filters.get('workflow')
+        return pattern is None or pattern.search(workflow_name) is not None
+    
+    def prunes(self, context):
+        """Check if no element of a subtree can match, from the context of its root"""
+        action, step, function = context
+        transition = self.filters.get('transition')
+        if transition is not None and action is not None and not transition.search(action):
+            return True
+        function_id = self.filters.get('function_id')
+        return function_id is not None and function is not None and not function_id.search(function)
+    
+    def accepts(self, context):
+        """Check the field conditions on the context dict of an element"""
+        for field, pattern in self.filters.items():
+            if not pattern.search(context[field]):
+                return False
+        return True
+    
+    def raw_pattern(self):
+        """Return a bytes regex found in the raw XML of every file with a hit, or None (see prescan_file).
         
-        # Move up to parent
-        current = parent_map.get(current)
+        Every word must be in a matching value, so the longest usable one is enough."""
+        patterns = [raw_term_pattern([word]) for word in sorted(self.words, key=len, reverse=True)]
+        return next((pattern for pattern in patterns if pattern is not None), None)
+    
+    def fts_query(self):
+        """Return the full-text query selecting the index postings that may match, or None to scan them all"""
+        words = [word for word in self.words if len(word) >= 3 and word.isascii()]
+        if not words:
+            return None
+        return ' AND '.join('"' + word.replace('"', '""') + '"' for word in words)
+
+def make_matcher(search_terms):
+    """Return a MultiTermMatcher for a term, a list of terms or an existing matcher (or Query)"""
+    if isinstance(search_terms, (MultiTermMatcher, Query)):
+        return search_terms
+    if isinstance(search_terms, str):
+        search_terms = [search_terms]
+    return MultiTermMatcher(search_terms)
+
+def match_element(elem, matcher, current_path, get_context, filename, verbose=True):
+    """Search the terms of a matcher (or a Query) in the text and attributes of a single element.
+    
+    get_context is called on the first hit and returns the Jira context dict of
+    elem. Each result is a SearchResult recording the term it matched and the
+    input name filename."""
+    results = []
+    context = None
+    
+    # Search in element text
+    if elem.text:
+        for index in matcher.find(elem.text):
+            if context is None:
+                context = get_context()
+            results.append(SearchResult.from_context(
+                context, current_path, filename,
+                matcher.content_of(elem.text, index), matcher.terms[index]))
+            if verbose and LOG_LEVEL >= VERBOSE:
+                log(f"  Found in element '{elem.tag}' text: {elem.text[:100]}...", VERBOSE)
+    
+    # Search in attributes
+    for attr_name, attr_value in elem.attrib.items():
+        for index in matcher.find(attr_value):
+            if context is None:
+                context = get_context()
+            # Add the actual content found
+            results.append(SearchResult.from_context(
+                context, f"{current_path}/@{attr_name}", filename,
+                f"{attr_name}=\"{attr_value}\"", matcher.terms[index]))
+            if verbose and LOG_LEVEL >= VERBOSE:
+                log(f"  Found in element '{elem.tag}' attribute '{attr_name}': {attr_value[:100]}...", VERBOSE)
+    
+    return results
+
+def index_element(elem, current_path, context, entries):
+    """Append the search index entries of an element's text and attributes.
+    
+    Entries are (transition, function_id, type, line, attribute name, value);
+    whitespace-only texts are not indexed."""
+    if elem.text and elem.text.strip():
+        entries.append((context['transition'], context['function_id'], context['type'],
+                        current_path, None, elem.text))
+    for attr_name, attr_value in elem.attrib.items():
+        entries.append((context['transition'], context['function_id'], context['type'],
+                        f"{current_path}/@{attr_name}", attr_name, attr_value))
+
+def child_path(paths, path, tag):
+    """Return the path of a child element, built once per (parent path, tag).
+    
+    paths caches the paths of a traversal: siblings with the same tag (and
+    their hits) share one interned path string instead of rebuilding it."""
+    key = (path, tag)
+    current_path = paths.get(key)
+    if current_path is None:
+        current_path = paths[key] = sys.intern(f"{path}/{tag}" if path else tag)
+    return current_path
+
+def iter_elements_with_context(tree, prune=None, prepare=None):
+    """Yield (element, path, context) for every element of a tree in document order.
     
-    return result
+    The traversal uses an explicit stack, so deeply nested exports cannot hit
+    the recursion limit, and carries the path and Jira context down the tree.
+    Subtrees whose root context satisfies prune (if given) are skipped, and
+    prepare (if given) is called on each element before its context is computed."""
+    stack = [(tree.getroot(), "", ROOT_CONTEXT)]
+    paths = {}
+    while stack:
+        elem, path, parent_context = stack.pop()
+        current_path = child_path(paths, path, elem.tag)
+        if prepare is not None:
+            prepare(elem)
+        context = element_context(elem, parent_context)
+        if prune is not None and prune(context):
+            continue
+        yield elem, current_path, context
+        # Children are pushed in reverse to be visited in document order
+        stack.extend((child, current_path, context) for child in reversed(elem))
+
+def collect_index_entries(tree, filename):
+    """Return the search index entries of every element of a decoded tree"""
+    entries = []
+    workflow_name = workflow_name_of(filename)
+    for elem, current_path, context in iter_elements_with_context(tree):
+        index_element(elem, current_path, context_result(elem, context, workflow_name), entries)
+    return entries
 
 def search_in_file(tree, search_term, filename):
-    """Search for a term in the decoded XML tree and collect results"""
+    """Search for a term (or a list of terms, or a MultiTermMatcher) in the decoded XML tree.
+    
+    Results are yielded as they are found, in document order."""
+    if not tree:
+        return
+    
+    matcher = make_matcher(search_term)
+    workflow_name = workflow_name_of(filename)
+    if matcher.filtered:
+        yield from search_tree_with_query(tree, matcher, filename, workflow_name)
+        return
+    for elem, current_path, context in iter_elements_with_context(tree):
+        yield from match_element(
+            elem, matcher, current_path,
+            lambda: context_result(elem, context, workflow_name),
+            filename)
+
+# Hits with the same values for these fields are reported once
+HIT_KEY_FIELDS = ('filename', 'workflow', 'transition', 'function_id', 'type', 'content', 'term')
+
+def group_results(results):
+    """Collapse identical hits into a single result, as they are found.
+    
+    Hits are grouped by hashing HIT_KEY_FIELDS; each result gets the number of
+    hits it stands for in count and their distinct locations in occurrences
+    (line stays the first one). Results must come file by file: the groups of
+    a file are yielded, in order of first hit, when the next file starts."""
+    key_of = attrgetter(*HIT_KEY_FIELDS)
+    groups = {}
+    current_file = None
+    for result in results:
+        if result.filename != current_file:
+            yield from groups.values()
+            groups = {}
+            current_file = result.filename
+        key = key_of(result)
+        group = groups.get(key)
+        if group is None:
+            result.count = 1
+            result.occurrences = [result.line]
+            groups[key] = result
+        else:
+            group.count += 1
+            if result.line not in group.occurrences:
+                group.occurrences.append(result.line)
+    yield from groups.values()
+
+def search_tree_with_query(tree, query, filename, workflow_name):
+    """Yield the results of a Query in a decoded XML tree, skipping the subtrees it prunes"""
+    if not query.matches_workflow(workflow_name):
+        return
+    for elem, current_path, context in iter_elements_with_context(tree, query.prunes):
+        element_context_result = context_result(elem, context, workflow_name)
+        if query.accepts(element_context_result):
+            yield from match_element(
+                elem, query, current_path,
+                lambda: element_context_result,
+                filename)
+
+def search_raw_file(input_path, search_term, filename=None):
+    """Search an XML file that was not decoded, decoding values only when the search reaches them.
+    
+    The attributes giving the Jira context of an element are decoded when it is
+    visited, its text and other attributes only when it is searched: subtrees
+    pruned by a Query and elements rejected by its filters are never decoded.
+    Decoded values replace the raw ones in the tree (and identical payloads
+    are decoded once through the decode cache). Nothing is written to disk.
+    input_path can also be a binary stream, filename is then required."""
+    filename = filename or os.path.basename(input_path)
+    matcher = make_matcher(search_term)
+    workflow_name = workflow_name_of(filename)
+    if matcher.filtered and not matcher.matches_workflow(workflow_name):
+        return
+    
+    tree = ET.parse(input_path)
+    prune = matcher.prunes if matcher.filtered else None
+    for elem, current_path, context in iter_elements_with_context(
+            tree, prune, lambda elem: decode_attributes(elem, CONTEXT_ATTRIBUTES)):
+        element_context_result = context_result(elem, context, workflow_name)
+        if matcher.filtered and not matcher.accepts(element_context_result):
+            continue
+        decode_element(elem, skip=CONTEXT_ATTRIBUTES)
+        yield from match_element(
+            elem, matcher, current_path,
+            lambda: element_context_result,
+            filename)
+
+# Outcomes of prescan_file; only PRESCAN_NO_HIT files are skipped
+PRESCAN_RAW_HIT = 'raw hit'
+PRESCAN_ENCODED = 'encoded payloads'
+PRESCAN_UNSURE = 'not scannable'
+PRESCAN_NO_HIT = 'no hit'
+
+# Raw XML that can hide a hit from a byte scan: character references other
+# than whitespace, CDATA sections, comments and entity declarations, and the
+# UTF-8 forms of the non-ASCII characters that match ASCII letters when case is
+# ignored (U+0130, U+0131, U+017F, U+212A)
+RAW_UNSAFE_RE = re.compile(
+    rb'&#(?!(?:0*(?:9|10|13)|x0*[9aAdD]);)|<!\[CDATA\[|<!--|<!ENTITY|\xc4[\xb0\xb1]|\xc5\xbf|\xe2\x84\xaa')
+# Raw values that may be whole base64 values: element texts and attribute values
+# of the base64 alphabet only. The delimiters are lookarounds: the closing quote
+# of an attribute is also the opening one of the next candidate (name="x" value="...")
+RAW_VALUE_RE = re.compile(rb'(?<=[>"\'])[ \t\r\n]*([A-Za-z0-9+/=]{4,})[ \t\r\n]*(?=[<"\'])')
+
+def prescan_file(path, pattern, payloads=False):
+    """Classify an XML file for a search from its raw bytes, without parsing it.
+    
+    The file is memory-mapped and scanned for pattern (see raw_pattern). A file
+    with no match can only have a hit when a value is escaped in a way the scan
+    cannot see, or, with payloads (files searched before decoding), when a hit
+    is hidden in a base64 payload. Returns PRESCAN_RAW_HIT, PRESCAN_UNSURE,
+    PRESCAN_ENCODED or, when the file provably has no hit, PRESCAN_NO_HIT."""
+    with open(path, 'rb') as f:
+        if os.fstat(f.fileno()).st_size == 0:
+            # Left to the parser to report
+            return PRESCAN_UNSURE
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as data:
+            if pattern.search(data):
+                return PRESCAN_RAW_HIT
+            # Only encodings where ASCII text is stored as ASCII bytes can be scanned
+            head = data[:4]
+            if head.startswith((codecs.BOM_UTF16_LE, codecs.BOM_UTF16_BE)) or b'\x00' in head:
+                return PRESCAN_UNSURE
+            if RAW_UNSAFE_RE.search(data):
+                return PRESCAN_UNSURE
+            if payloads:
+                if data.find(b'`!`') != -1 or data.find(b'YCFg') != -1:
+                    return PRESCAN_ENCODED
+                for match in RAW_VALUE_RE.finditer(data):
+                    if is_base64(match.group(1).decode('ascii')):
+                        return PRESCAN_ENCODED
+    return PRESCAN_NO_HIT
+
+def prescan_input(source, pattern):
+    """Classify an input that was not decoded (see prescan_file); compressed inputs are not scanned"""
+    path, member = source[:2]
+    if member is not None or path.endswith('.gz'):
+        return PRESCAN_UNSURE
+    return prescan_file(path, pattern, payloads=True)
+
+def escape_xml_text(text):
+    """Escape element text and tails the same way ElementTree.write does"""
+    if '&' in text:
+        text = text.replace('&', '&amp;')
+    if '<' in text:
+        text = text.replace('<', '&lt;')
+    if '>' in text:
+        text = text.replace('>', '&gt;')
+    return text
+
+def escape_xml_attrib(value):
+    """Escape attribute values the same way ElementTree.write does"""
+    value = escape_xml_text(value)
+    if '"' in value:
+        value = value.replace('"', '&quot;')
+    if '\r' in value:
+        value = value.replace('\r', '&#13;')
+    if '\n' in value:
+        value = value.replace('\n', '&#10;')
+    if '\t' in value:
+        value = value.replace('\t', '&#09;')
+    return value
+
+def stream_xml_file(input_path, decoded_path=None, search_term=None, filename=None, decode=True,
+                    index_entries=None, payloads=None):
+    """Decode and/or search an XML file in a single streaming pass.
+    
+    Elements are decoded, searched and written to decoded_path (if given) as soon
+    as their text is known, then discarded: memory is bounded by the nesting depth
+    of the workflow instead of its size. With decode=False the values are searched
+    as they are (used for files that are already decoded). The search index entries
+    of the decoded elements are appended to index_entries if given, and the decoded
+    payloads are recorded in payloads (a PayloadCollector) if given.
+    
+    search_term can be a term, a list of terms or a MultiTermMatcher. input_path
+    can also be a binary stream, filename is then required.
+    Returns the search results (empty without a search term)."""
+    filename = filename or os.path.basename(input_path)
     search_results = []
+    matcher = make_matcher(search_term) if search_term is not None else None
+    if matcher is not None and matcher.filtered and not matcher.matches_workflow(workflow_name_of(filename)):
+        # The file is still decoded, but nothing in it can match
+        matcher = None
     
-    def search_element(elem, term, path="", parent_map=None):
-        # Build parent map for context extraction
-        if parent_map is None:
-            parent_map = {c: p for p in tree.iter() for c in p}
-        
-        current_path = f"{path}/{elem.tag}" if path else elem.tag
-        
-        # Search in element text
-        if elem.text and term.lower() in elem.text.lower():
-            context = extract_jira_context_from_path(tree, elem, parent_map, filename)
-            context['line'] = current_path
-            context['filename'] = os.path.basename(filename)
-            # Add the actual content found - just the line containing the search term
-            lines = elem.text.strip().split('\n')
-            matching_line = ''
-            for line in lines:
-                if term.lower() in line.lower():
-                    matching_line = line.strip()
-                    break
-            context['content'] = matching_line if matching_line else elem.text.strip()
-            search_results.append(context)
-            print(f"  Found in element '{elem.tag}' text: {elem.text[:100]}...")
-        
-        # Search in attributes
-        for attr_name, attr_value in elem.attrib.items():
-            if term.lower() in attr_value.lower():
-                context = extract_jira_context_from_path(tree, elem, parent_map, filename)
-                context['line'] = f"{current_path}/@{attr_name}"
-                context['filename'] = os.path.basename(filename)
-                # Add the actual content found
-                context['content'] = f"{attr_name}=\"{attr_value}\""
-                search_results.append(context)
-                print(f"  Found in element '{elem.tag}' attribute '{attr_name}': {attr_value[:100]}...")
-        
-        # Recursively search child elements
-        for child in elem:
-            search_element(child, term, current_path, parent_map)
+    out = None
+    if decoded_path:
+        # Write to a temporary file so a failure never leaves a truncated output
+        temp_path = decoded_path + '.tmp'
+        out = open(temp_path, 'w', encoding='utf-8', errors='xmlcharrefreplace')
+        out.write("<?xml version='1.0' encoding='UTF-8'?>\n")
+    
+    # Open elements as [element, path, start tag written, Jira context]
+    stack = []
+    paths = {}
+    workflow_name = workflow_name_of(filename)
+    # Last closed element and its parent: its tail is only known at the next event
+    pending = None
     
-    if tree:
-        root = tree.getroot()
-        search_element(root, search_term)
+    def flush(empty=False):
+        # Decode, search and write the start tag of the innermost open element
+        entry = stack[-1]
+        elem, path = entry[0], entry[1]
+        entry[2] = True
+        if decode:
+            if payloads is not None:
+                payloads.decode_element(elem)
+            else:
+                decode_element(elem)
+        # Context from the decoded attributes, the parent is always flushed first
+        context = element_context(elem, stack[-2][3] if len(stack) > 1 else ROOT_CONTEXT)
+        entry[3] = context
+        if payloads is not None:
+            payloads.collect(elem, path, context)
+        if matcher is not None and (not matcher.filtered or matcher.accepts(
+                context_result(elem, context, workflow_name))):
+            search_results.extend(match_element(
+                elem, matcher, path,
+                lambda: context_result(elem, context, workflow_name),
+                filename, verbose=False))
+        if index_entries is not None:
+            index_element(elem, path, context_result(elem, context, workflow_name), index_entries)
+        if out:
+            out.write(f"<{elem.tag}")
+            for attr_name, attr_value in elem.attrib.items():
+                out.write(f' {attr_name}="{escape_xml_attrib(attr_value)}"')
+            # Mirror ElementTree's short form for empty elements
+            if empty and not elem.text:
+                out.write(" />")
+                return
+            out.write(">")
+            if elem.text:
+                out.write(escape_xml_text(elem.text))
+            if empty:
+                out.write(f"</{elem.tag}>")
+    
+    def release_pending():
+        elem, parent = pending
+        if out and elem.tail:
+            out.write(escape_xml_text(elem.tail))
+        # Drop the finished element so the tree never grows
+        elem.clear()
+        if parent is not None:
+            parent.remove(elem)
+    
+    try:
+        for event, elem in ET.iterparse(input_path, events=('start', 'end')):
+            if pending:
+                release_pending()
+                pending = None
+            
+            if event == 'start':
+                # The parent's text is complete once its first child starts
+                if stack and not stack[-1][2]:
+                    flush()
+                path = child_path(paths, stack[-1][1] if stack else "", elem.tag)
+                stack.append([elem, path, False, None])
+                continue
+            
+            if not stack[-1][2]:
+                # No children: the start tag is written together with the end tag
+                flush(empty=True)
+            elif out:
+                out.write(f"</{elem.tag}>")
+            stack.pop()
+            pending = (elem, stack[-1][0] if stack else None)
+        
+        if pending:
+            release_pending()
+        
+        if out:
+            out.close()
+            os.replace(temp_path, decoded_path)
+    finally:
+        if out and not out.closed:
+            out.close()
+            os.unlink(temp_path)
+    
+    return search_results
+
+PAGED_RESULTS_STYLE = """
+        .filter-bar {
+            display: flex;
+            flex-wrap: wrap;
+            gap: 10px;
+            margin-bottom: 15px;
+        }
+        .filter-bar select,
+        .filter-bar input {
+            padding: 6px 8px;
+            border: 1px solid #dfe1e6;
+            border-radius: 4px;
+            font-size: 13px;
+            max-width: 220px;
+        }
+        .pager {
+            display: flex;
+            align-items: center;
+            gap: 10px;
+            margin-top: 15px;
+            color: #6b778c;
+            font-size: 14px;
+        }
+        .pager button {
+            background-color: #f4f5f7;
+            border: 1px solid #dfe1e6;
+            border-radius: 4px;
+            padding: 6px 12px;
+            cursor: pointer;
+        }
+        .pager button:disabled {
+            opacity: 0.5;
+            cursor: default;
+        }
+"""
+
+# Renders the rows of the current page from searchResultsData, so every result
+# is stored once in the page and the browser only lays out one page of rows
+PAGED_RESULTS_SCRIPT = r"""
+        const filterFields = ['term', 'workflow', 'transition', 'type'];
+        let filteredIndexes = [];
+        let currentPage = 0;
+        
+        function escapeHtml(text) {
+            return String(text).replace(/&/g, '&amp;').replace(/</g, '&lt;').replace(/>/g, '&gt;').replace(/"/g, '&quot;');
+        }
+        
+        function highlightTerm(escapedText, term) {
+            const pattern = escapeHtml(term).replace(/[.*+?^${}()|[\]\\]/g, '\\$&');
+            return escapedText.replace(new RegExp(pattern, 'gi'), match => '<span class="highlight">' + match + '</span>');
+        }
+        
+        function detailsCell(value, cssClass, index, maxLength) {
+            if (value === 'N/A') {
+                return '<td><span class="na-value">N/A</span></td>';
+            }
+            return '<td><span class="' + cssClass + ' truncated clickable" onclick="showDetails(' + index + ')" title="Click for details">' +
+                escapeHtml(truncateText(value, maxLength)) + '</span></td>';
+        }
+        
+        function rowHtml(index) {
+            const result = searchResultsData[index];
+            let html = '<tr>';
+            if (multipleTerms) {
+                html += '<td><span class="type-tag">' + escapeHtml(result.term) + '</span></td>';
+            }
+            html += detailsCell(result.workflow, 'workflow-name', index, 35);
+            html += detailsCell(result.transition, 'transition-name', index, 25);
+            html += detailsCell(result.function_id, 'function-id', index, 25);
+            html += '<td><span class="type-tag">' + escapeHtml(result.type) + '</span></td>';
+            if (result.content) {
+                html += '<td><div class="content-snippet clickable" onclick="showDetails(' + index + ')" title="Click for details">' +
+                    highlightTerm(escapeHtml(truncateText(result.content, 70)), result.term || searchTerm) +
+                    (result.count > 1 ? ' <span class="occurrence-count">&times;' + result.count + '</span>' : '') + '</div></td>';
+            } else {
+                html += '<td><span class="na-value">N/A</span></td>';
+            }
+            return html + '</tr>';
+        }
+        
+        function fillFilter(field) {
+            const select = document.getElementById('filter-' + field);
+            if (!select) return;
+            const values = Array.from(new Set(searchResultsData.map(result => result[field]))).sort();
+            values.forEach(value => {
+                const option = document.createElement('option');
+                option.value = value;
+                option.textContent = value;
+                select.appendChild(option);
+            });
+        }
+        
+        function applyFilters() {
+            const selected = {};
+            filterFields.forEach(field => {
+                const select = document.getElementById('filter-' + field);
+                if (select && select.value !== '') selected[field] = select.value;
+            });
+            const text = document.getElementById('filter-text').value.toLowerCase();
+            filteredIndexes = [];
+            searchResultsData.forEach((result, index) => {
+                for (const field in selected) {
+                    if (result[field] !== selected[field]) return;
+                }
+                if (text && result.content.toLowerCase().indexOf(text) === -1) return;
+                filteredIndexes.push(index);
+            });
+            currentPage = 0;
+            renderPage();
+        }
+        
+        function renderPage() {
+            const pageSize = parseInt(document.getElementById('page-size').value, 10);
+            const pageCount = Math.max(1, Math.ceil(filteredIndexes.length / pageSize));
+            currentPage = Math.min(Math.max(currentPage, 0), pageCount - 1);
+            const start = currentPage * pageSize;
+            document.getElementById('results-body').innerHTML =
+                filteredIndexes.slice(start, start + pageSize).map(rowHtml).join('');
+            document.getElementById('page-info').textContent = 'Page ' + (currentPage + 1) + ' of ' + pageCount +
+                ' - ' + filteredIndexes.length + ' of ' + searchResultsData.length + ' results';
+            document.getElementById('prev-page').disabled = currentPage === 0;
+            document.getElementById('next-page').disabled = currentPage >= pageCount - 1;
+        }
+        
+        function changePage(delta) {
+            currentPage += delta;
+            renderPage();
+        }
+        
+        document.addEventListener('DOMContentLoaded', () => {
+            filterFields.forEach(fillFilter);
+            applyFilters();
+        });
+"""
+
+def script_json(data):
+    """Serialize data for a <script> block: compact, and a '</script>' in a value cannot end the block"""
+    return json.dumps(data, separators=(',', ':')).replace('</', '<\\/')
+
+class ResultSpool:
+    """Results kept in a temporary file instead of memory, in the order they were added.
+    
+    Iterating reads the results back from the file, so a spool can be read
+    several times while only one result at a time is in memory."""
+    
+    def __init__(self, results=()):
+        self.file = tempfile.TemporaryFile('w+', encoding='utf-8')
+        self.counts = Counter()
+        for result in results:
+            self.append(result)
+    
+    def append(self, result):
+        # One JSON record per line, already escaped for a <script> block
+        self.file.write(script_json(result.as_dict()) + '\n')
+        self.counts[result.term] += 1
+    
+    def __len__(self):
+        return sum(self.counts.values())
+    
+    def json_records(self):
+        """Yield the results as serialized by script_json"""
+        self.file.flush()
+        self.file.seek(0)
+        for line in self.file:
+            yield line.rstrip('\n')
+        self.file.seek(0, os.SEEK_END)
+    
+    def __iter__(self):
+        for record in self.json_records():
+            yield SearchResult.from_dict(json.loads(record))
+    
+    def close(self):
+        self.file.close()
+
+def write_results_to_file(search_term, all_results, render='auto', filename="./result.html"):
+    """Write search results to result.html"""
+    with open(filename, 'w', encoding='utf-8') as f:
+        write_results_page(f, search_term, all_results, render)
+    
+    log(f"\nResults written to {filename}", QUIET)
+    log(f"Open the file in your browser: {os.path.abspath(filename)}")
+
+def write_results_page(f, search_term, all_results, render='auto'):
+    """Write the search results page to an open text file.
+    
+    all_results is a list or a ResultSpool. search_term can also be a list of
+    terms: the results are then shown in one section per term.
+    
+    render is 'table' (one static row per result), 'paged' (rows rendered page by
+    page in the browser from the embedded results, with filters) or 'auto'
+    (paged above STATIC_TABLE_LIMIT results)."""
+    spooled = isinstance(all_results, ResultSpool)
+    if not spooled:
+        all_results = ResultSpool(all_results)
+    paged = render == 'paged' or (render == 'auto' and len(all_results) > STATIC_TABLE_LIMIT)
+    
+    search_terms = [search_term] if isinstance(search_term, str) else list(search_term)
+    if len(search_terms) == 1:
+        search_term = search_terms[0]
+    else:
+        search_term = ', '.join(search_terms)
     
-    return search_results
-
-def write_results_to_file(search_term, all_results):
-    """Write search results to result.html"""
-    filename = "./result.html"
+    # Escape the search term for JavaScript
+    js_search_term = search_term.replace("'", "\\'").replace('"', '\\"')
     
-    with open(filename, 'w', encoding='utf-8') as f:
-        # Escape the search term for JavaScript
-        js_search_term = search_term.replace("'", "\\'").replace('"', '\\"')
-        
-        # Write HTML with embedded data
-        f.write(f"""<!DOCTYPE html>
+    # Write HTML with embedded data
+    f.write(f"""<!DOCTYPE html>
 <html lang="en">
 <head>
     <meta charset="UTF-8">
@@ -355,6 +1680,14 @@ def write_results_to_file(search_term, all_results):
             font-weight: 600;
             display: inline-block;
         }}
+        .occurrence-count {{
+            background-color: #0052cc;
+            color: white;
+            padding: 1px 6px;
+            border-radius: 10px;
+            font-size: 11px;
+            font-weight: 600;
+        }}
         .location-path {{
             color: #6b778c;
             font-family: 'Courier New', monospace;
@@ -385,6 +1718,10 @@ def write_results_to_file(search_term, all_results):
             text-decoration: underline;
             cursor: pointer;
         }}
+        .term-header {{
+            color: #172b4d;
+            margin: 30px 0 10px 0;
+        }}
         /* Modal styles */
         .modal {{
             display: none;
@@ -568,12 +1905,20 @@ def write_results_to_file(search_term, all_results):
         .na-value {{
             color: #97a0af;
             font-style: italic;
-        }}
+        }}{PAGED_RESULTS_STYLE if paged else ''}
     </style>
     <script>
         // Store results data globally
-        const searchResultsData = {json.dumps(all_results)};
+        const searchResultsData = """)
+    # The results are copied from the spool one at a time
+    f.write('[')
+    for i, record in enumerate(all_results.json_records()):
+        if i:
+            f.write(',')
+        f.write(record)
+    f.write(f"""];
         const searchTerm = "{js_search_term}";
+        const multipleTerms = {'true' if len(search_terms) > 1 else 'false'};
         
         function stripHtml(html) {{
             // Al momento voglio mostrare il testo HTML originale
@@ -592,9 +1937,16 @@ def write_results_to_file(search_term, all_results):
                 text += 'Workflow: ' + result.workflow + '\\n';
                 text += 'Transition: ' + result.transition + '\\n';
                 text += 'Function ID: ' + result.function_id + '\\n';
+                if (result.term !== undefined && result.term !== searchTerm) {{
+                    text += 'Term: ' + result.term + '\\n';
+                }}
                 text += 'Type: ' + result.type + '\\n';
                 text += 'Content: ' + stripHtml(result.content) + '\\n';
-                text += 'Location: ' + result.line + '\\n\\n';
+                text += 'Location: ' + result.line + '\\n';
+                if (result.count > 1) {{
+                    text += 'Occurrences: ' + result.count + ' (' + result.occurrences.join(', ') + ')\\n';
+                }}
+                text += '\\n';
             }});
             
             const blob = new Blob([text], {{ type: 'text/plain' }});
@@ -653,6 +2005,14 @@ def write_results_to_file(search_term, all_results):
                     <div class="detail-value">${{result.line}}</div>
                 </div>
             `;
+            if (result.count > 1) {{
+                contentHtml += `
+                <div class="detail-row">
+                    <div class="detail-label">Occurrences:</div>
+                    <div class="detail-value">${{result.count}} identical hits at:<br>${{result.occurrences.join('<br>')}}</div>
+                </div>
+            `;
+            }}
             
             modalContent.innerHTML = contentHtml;
             modal.style.display = 'block';
@@ -669,7 +2029,7 @@ def write_results_to_file(search_term, all_results):
             if (event.target == modal) {{
                 modal.style.display = 'none';
             }}
-        }}
+        }}{PAGED_RESULTS_SCRIPT if paged else ''}
     </script>
 </head>
 <body>
@@ -700,11 +2060,83 @@ def write_results_to_file(search_term, all_results):
             <div class="timestamp">Generated on: {datetime.now().strftime("%Y-%m-%d %H:%M:%S")}</div>
         </div>
 """)
-        
-        if not all_results:
-            f.write(f'        <div class="no-results">No results found for "{search_term}"</div>\n')
-        else:
-            f.write("""        <div class="table-container">
+    
+    if len(search_terms) == 1 and not all_results:
+        f.write(f'        <div class="no-results">No results found for "{search_term}"</div>\n')
+    elif paged:
+        write_paged_results(f, len(search_terms) > 1)
+    elif len(search_terms) == 1:
+        write_results_table(f, enumerate(all_results), search_term)
+    else:
+        # One section per term, in the order the terms were given
+        for term in search_terms:
+            term_count = all_results.counts[term]
+            f.write(f'        <h3 class="term-header">"{term}" ({term_count} results)</h3>\n')
+            if term_count:
+                write_results_table(f, ((i, result) for i, result in enumerate(all_results)
+                                        if result.term == term), term)
+            else:
+                f.write(f'        <div class="no-results">No results found for "{term}"</div>\n')
+    
+    if all_results:
+        f.write(f'        <div class="result-count">Total results found: {len(all_results)}</div>\n')
+        f.write(f'        <button class="export-button" onclick="exportToText()">Export to Text</button>\n')
+    
+    f.write("""        </div>
+    </div>
+</body>
+</html>
+""")
+    
+    if not spooled:
+        all_results.close()
+
+def write_paged_results(f, multiple_terms):
+    """Write the filters, the empty table and the pager filled by PAGED_RESULTS_SCRIPT"""
+    f.write('        <div class="filter-bar">\n')
+    if multiple_terms:
+        f.write('            <select id="filter-term" onchange="applyFilters()"><option value="">All terms</option></select>\n')
+    f.write("""            <select id="filter-workflow" onchange="applyFilters()"><option value="">All workflows</option></select>
+            <select id="filter-transition" onchange="applyFilters()"><option value="">All transitions</option></select>
+            <select id="filter-type" onchange="applyFilters()"><option value="">All types</option></select>
+            <input id="filter-text" type="text" placeholder="Filter content..." oninput="applyFilters()">
+        </div>
+        <div class="table-container">
+            <table>
+                <thead>
+                    <tr>
+""")
+    if multiple_terms:
+        f.write('                        <th style="width: 10%;">Term</th>\n')
+    f.write("""                        <th style="width: 18%;">Workflow</th>
+                        <th style="width: 17%;">Transition</th>
+                        <th style="width: 17%;">Function ID</th>
+                        <th style="width: 10%;">Type</th>
+                        <th style="width: 25%;">Content</th>
+                    </tr>
+                </thead>
+                <tbody id="results-body">
+                </tbody>
+            </table>
+        </div>
+        <div class="pager">
+            <button id="prev-page" onclick="changePage(-1)">Previous</button>
+            <span id="page-info"></span>
+            <button id="next-page" onclick="changePage(1)">Next</button>
+            <select id="page-size" onchange="renderPage()">
+                <option value="50">50 per page</option>
+                <option value="100" selected>100 per page</option>
+                <option value="250">250 per page</option>
+                <option value="500">500 per page</option>
+            </select>
+        </div>
+""")
+
+def write_results_table(f, indexed_results, search_term):
+    """Write the table of the results of one search term.
+    
+    indexed_results yields (position in searchResultsData, result) pairs."""
+    f.write("""        <div class="table-container">
             <table>
                 <thead>
                     <tr>
@@ -717,151 +2149,1314 @@ def write_results_to_file(search_term, all_results):
                 </thead>
                 <tbody>
 """)
+    
+    for i, result in indexed_results:
+        f.write('                <tr>\n')
+        
+        # Workflow name
+        workflow = result.workflow
+        truncated_workflow = workflow[:35] + '...' if len(workflow) > 35 else workflow
+        f.write(f'                    <td><span class="workflow-name truncated clickable" onclick="showDetails({i})" title="Click for details">{truncated_workflow}</span></td>\n')
+        
+        # Transition
+        transition = result.transition
+        truncated_transition = transition[:25] + '...' if len(transition) > 25 else transition
+        if transition != 'N/A':
+            f.write(f'                    <td><span class="transition-name truncated clickable" onclick="showDetails({i})" title="Click for details">{truncated_transition}</span></td>\n')
+        else:
+            f.write(f'                    <td><span class="na-value">{transition}</span></td>\n')
+        
+        # Function ID
+        function_id = result.function_id
+        truncated_function = function_id[:25] + '...' if len(function_id) > 25 else function_id
+        if function_id != 'N/A':
+            f.write(f'                    <td><span class="function-id truncated clickable" onclick="showDetails({i})" title="Click for details">{truncated_function}</span></td>\n')
+        else:
+            f.write(f'                    <td><span class="na-value">{function_id}</span></td>\n')
+        
+        # Type
+        type_val = result.type
+        f.write(f'                    <td><span class="type-tag">{type_val}</span></td>\n')
+        
+        # Content
+        content = result.content
+        if content != 'N/A' and len(content) > 0:
+            # Escape HTML and highlight the search term
+            escaped_content = content.replace('&', '&amp;').replace('<', '&lt;').replace('>', '&gt;')
+            truncated_content = escaped_content[:70] + '...' if len(escaped_content) > 70 else escaped_content
+            highlighted_content = truncated_content
+            for variant in [search_term, search_term.lower(), search_term.upper()]:
+                highlighted_content = highlighted_content.replace(variant, f'<span class="highlight">{variant}</span>')
             
-            for i, result in enumerate(all_results):
-                f.write('                <tr>\n')
-                
-                # Workflow name
-                workflow = result.get('workflow', 'N/A')
-                truncated_workflow = workflow[:35] + '...' if len(workflow) > 35 else workflow
-                f.write(f'                    <td><span class="workflow-name truncated clickable" onclick="showDetails({i})" title="Click for details">{truncated_workflow}</span></td>\n')
-                
-                # Transition
-                transition = result.get('transition', 'N/A')
-                truncated_transition = transition[:25] + '...' if len(transition) > 25 else transition
-                if transition != 'N/A':
-                    f.write(f'                    <td><span class="transition-name truncated clickable" onclick="showDetails({i})" title="Click for details">{truncated_transition}</span></td>\n')
-                else:
-                    f.write(f'                    <td><span class="na-value">{transition}</span></td>\n')
-                
-                # Function ID
-                function_id = result.get('function_id', 'N/A')
-                truncated_function = function_id[:25] + '...' if len(function_id) > 25 else function_id
-                if function_id != 'N/A':
-                    f.write(f'                    <td><span class="function-id truncated clickable" onclick="showDetails({i})" title="Click for details">{truncated_function}</span></td>\n')
-                else:
-                    f.write(f'                    <td><span class="na-value">{function_id}</span></td>\n')
-                
-                # Type
-                type_val = result.get('type', 'N/A')
-                f.write(f'                    <td><span class="type-tag">{type_val}</span></td>\n')
-                
-                # Content
-                content = result.get('content', 'N/A')
-                if content != 'N/A' and len(content) > 0:
-                    # Escape HTML and highlight the search term
-                    escaped_content = content.replace('&', '&amp;').replace('<', '&lt;').replace('>', '&gt;')
-                    truncated_content = escaped_content[:70] + '...' if len(escaped_content) > 70 else escaped_content
-                    highlighted_content = truncated_content
-                    for variant in [search_term, search_term.lower(), search_term.upper()]:
-                        highlighted_content = highlighted_content.replace(variant, f'<span class="highlight">{variant}</span>')
-                    
-                    f.write(f'                    <td><div class="content-snippet clickable" onclick="showDetails({i})" title="Click for details">{highlighted_content}</div></td>\n')
-                else:
-                    f.write(f'                    <td><span class="na-value">N/A</span></td>\n')
-                
-                f.write('                </tr>\n')
+            if result.count and result.count > 1:
+                highlighted_content += f' <span class="occurrence-count">&times;{result.count}</span>'
             
-            f.write("""                </tbody>
+            f.write(f'                    <td><div class="content-snippet clickable" onclick="showDetails({i})" title="Click for details">{highlighted_content}</div></td>\n')
+        else:
+            f.write(f'                    <td><span class="na-value">N/A</span></td>\n')
+        
+        f.write('                </tr>\n')
+    
+    f.write("""                </tbody>
             </table>
         </div>
 """)
-            f.write(f'        <div class="result-count">Total results found: {len(all_results)}</div>\n')
-            f.write(f'        <button class="export-button" onclick="exportToText()">Export to Text</button>\n')
-        
-        f.write("""        </div>
-    </div>
-</body>
-</html>
-""")
+
+class JsonLinesResultSink:
+    """Write each result to a JSON Lines file as soon as it is found"""
+    
+    def __init__(self, filename):
+        self.filename = filename
+        self.file = open(filename, 'w', encoding='utf-8')
+    
+    def write(self, result):
+        self.file.write(json.dumps(result.as_dict(), ensure_ascii=False) + '\n')
+    
+    def flush(self):
+        self.file.flush()
+    
+    def close(self):
+        self.file.close()
+        log(f"Results written to {self.filename}", QUIET)
+
+class CsvResultSink:
+    """Write each result to a CSV file as soon as it is found"""
+    
+    def __init__(self, filename):
+        self.filename = filename
+        self.file = open(filename, 'w', encoding='utf-8', newline='')
+        self.writer = csv.writer(self.file)
+        self.writer.writerow(RESULT_FIELDS)
+    
+    def write(self, result):
+        row = [getattr(result, field) for field in RESULT_FIELDS]
+        if result.occurrences is not None:
+            row[-1] = '; '.join(result.occurrences)
+        self.writer.writerow(row)
+    
+    def flush(self):
+        self.file.flush()
+    
+    def close(self):
+        self.file.close()
+        log(f"Results written to {self.filename}", QUIET)
+
+class HtmlResultSink:
+    """Write the results to result.html.
+    
+    The layout of the page depends on the number of results, so results are
+    spooled to a temporary file as they are found and the page is written
+    when the sink is closed."""
+    
+    def __init__(self, filename, search_terms, render='auto'):
+        self.filename = filename
+        self.search_terms = search_terms
+        self.render = render
+        self.spool = ResultSpool()
     
-    print(f"\nResults written to {filename}")
-    print(f"Open the file in your browser: {os.path.abspath(filename)}")
+    def write(self, result):
+        self.spool.append(result)
+    
+    def flush(self):
+        pass
+    
+    def close(self):
+        write_results_to_file(self.search_terms, self.spool, self.render, self.filename)
+        self.spool.close()
+
+RESULT_FORMATS = ['html', 'jsonl', 'csv']
+
+def open_result_sinks(formats, search_terms, render='auto'):
+    """Return a sink writing ./result.<format> for each requested format"""
+    sinks = []
+    for result_format in dict.fromkeys(formats):
+        filename = f"./result.{result_format}"
+        if result_format == 'html':
+            sinks.append(HtmlResultSink(filename, search_terms, render))
+        elif result_format == 'jsonl':
+            sinks.append(JsonLinesResultSink(filename))
+        elif result_format == 'csv':
+            sinks.append(CsvResultSink(filename))
+    return sinks
 
-def clear_output_directory(output_dir):
-    """Clear all files in the output directory"""
+def clear_output_directory(output_dir, keep=()):
+    """Clear all files in the output directory and its subfolders, except the file names in keep"""
     if os.path.exists(output_dir):
-        for filename in os.listdir(output_dir):
-            file_path = os.path.join(output_dir, filename)
-            try:
-                if os.path.isfile(file_path):
+        deleted = 0
+        for dirpath, dirnames, filenames in os.walk(output_dir, topdown=False):
+            for filename in filenames:
+                if dirpath == output_dir and filename in keep:
+                    continue
+                file_path = os.path.join(dirpath, filename)
+                try:
                     os.unlink(file_path)
-                    print(f"Deleted: {file_path}")
-            except Exception as e:
-                print(f"Error deleting {file_path}: {e}")
+                    deleted += 1
+                    log(f"Deleted: {file_path}", VERBOSE)
+                except Exception as e:
+                    log(f"Error deleting {file_path}: {e}", QUIET)
+            if dirpath != output_dir and not os.listdir(dirpath):
+                os.rmdir(dirpath)
+        log(f"Deleted {deleted} files from {output_dir}")
     else:
         os.makedirs(output_dir)
 
+def hash_input(source):
+    """Return the SHA-256 hex digest of the XML of an input (decompressed)"""
+    digest = hashlib.sha256()
+    with open_input(source) as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+def load_manifest(output_dir):
+    """Load the decode manifest of the output directory (empty if missing or outdated)"""
+    manifest_path = os.path.join(output_dir, MANIFEST_FILENAME)
+    try:
+        with open(manifest_path, 'r', encoding='utf-8') as f:
+            manifest = json.load(f)
+        if manifest.get('version') == DECODER_VERSION:
+            return manifest.get('files', {})
+        log("Decoder version changed, rebuilding all decoded files.")
+    except FileNotFoundError:
+        pass
+    except (ValueError, OSError) as e:
+        log(f"Error reading manifest {manifest_path}: {e}", QUIET)
+    return {}
+
+def save_manifest(output_dir, entries):
+    """Write the decode manifest of the output directory"""
+    manifest_path = os.path.join(output_dir, MANIFEST_FILENAME)
+    with open(manifest_path, 'w', encoding='utf-8') as f:
+        json.dump({'version': DECODER_VERSION, 'files': entries}, f, indent=2, sort_keys=True)
+
+def is_cached(source, decoded_path, entry):
+    """Check if a manifest entry is still valid for an input (see list_inputs).
+    
+    Size and mtime are compared first; the content hash is only computed
+    when they differ (e.g. after a fresh copy of an identical export).
+    Updates the entry in place when only the mtime changed."""
+    if not entry or not os.path.exists(decoded_path):
+        return False
+    
+    size, mtime_ns = source[2:]
+    if entry.get('size') == size and entry.get('mtime_ns') == mtime_ns:
+        return True
+    
+    if entry.get('size') == size and entry.get('sha256') == hash_input(source):
+        entry['mtime_ns'] = mtime_ns
+        return True
+    return False
+
+def make_manifest_entry(source, output_dir, decoded_path, sha256=None):
+    """Build the manifest entry for a freshly decoded input.
+    
+    sha256 is the hash taken while decoding; without it the input is read again."""
+    return {
+        'size': source[2],
+        'mtime_ns': source[3],
+        'sha256': sha256 or hash_input(source),
+        'output': os.path.relpath(decoded_path, output_dir).replace(os.sep, '/')
+    }
+
+def remove_stale_outputs(output_dir, manifest, xml_files):
+    """Delete decoded files whose input no longer exists"""
+    for xml_file in list(manifest):
+        if xml_file not in xml_files:
+            decoded_path = os.path.join(output_dir, manifest.pop(xml_file)['output'])
+            if not is_inside(decoded_path, output_dir):
+                log(f"Not deleting {decoded_path}: outside {output_dir}", QUIET)
+                continue
+            if os.path.exists(decoded_path):
+                os.unlink(decoded_path)
+                log(f"Deleted: {decoded_path}", VERBOSE)
+            # Drop the folders left empty by a removed archive or subfolder
+            folder = os.path.dirname(decoded_path)
+            while os.path.normpath(folder) != os.path.normpath(output_dir) and not os.listdir(folder):
+                os.rmdir(folder)
+                folder = os.path.dirname(folder)
+
+class SearchIndex:
+    """Persistent search index of the decoded workflows, stored in SQLite.
+    
+    Every element text and attribute value is a posting carrying the Jira context
+    of the hit (transition, function_id, type, line). Values are indexed with an
+    FTS5 trigram index so a substring search only reads candidate postings, which
+    are then checked exactly like search_in_file does: no XML is parsed to answer
+    a search. Each file is stored with the SHA-256 of its input so only changed
+    files are indexed again."""
+    
+    def __init__(self, path):
+        self.connection = sqlite3.connect(path)
+        self.trigram = True
+        version = None
+        try:
+            version = self.connection.execute("SELECT value FROM meta WHERE key = 'version'").fetchone()
+        except sqlite3.DatabaseError:
+            pass
+        if version is None or version[0] != str(DECODER_VERSION):
+            self.create_schema()
+    
+    def create_schema(self):
+        connection = self.connection
+        connection.executescript("""
+            DROP TABLE IF EXISTS meta;
+            DROP TABLE IF EXISTS files;
+            DROP TABLE IF EXISTS postings;
+            DROP TABLE IF EXISTS postings_text;
+            CREATE TABLE meta (key TEXT PRIMARY KEY, value TEXT);
+            CREATE TABLE files (filename TEXT PRIMARY KEY, sha256 TEXT);
+            CREATE TABLE postings (
+                id INTEGER PRIMARY KEY,
+                filename TEXT, position INTEGER,
+                transition TEXT, function_id TEXT, type TEXT, line TEXT,
+                attr_name TEXT, value TEXT);
+            CREATE INDEX postings_file ON postings (filename, position);
+        """)
+        try:
+            connection.execute("CREATE VIRTUAL TABLE postings_text USING fts5("
+                               "value, content='postings', content_rowid='id', tokenize='trigram')")
+        except sqlite3.OperationalError:
+            # SQLite without FTS5 trigrams (< 3.34): searches scan the postings
+            self.trigram = False
+        connection.execute("INSERT INTO meta VALUES ('version', ?)", (str(DECODER_VERSION),))
+        connection.commit()
+    
+    def has_trigram_table(self):
+        return self.connection.execute(
+            "SELECT 1 FROM sqlite_master WHERE name = 'postings_text'").fetchone() is not None
+    
+    def indexed_files(self):
+        """Return {filename: sha256 of the indexed input}"""
+        return dict(self.connection.execute("SELECT filename, sha256 FROM files"))
+    
+    def remove_file(self, filename):
+        connection = self.connection
+        if self.has_trigram_table():
+            connection.execute("INSERT INTO postings_text (postings_text, rowid, value) "
+                               "SELECT 'delete', id, value FROM postings WHERE filename = ?", (filename,))
+        connection.execute("DELETE FROM postings WHERE filename = ?", (filename,))
+        connection.execute("DELETE FROM files WHERE filename = ?", (filename,))
+    
+    def replace_file(self, filename, sha256, entries):
+        """Replace the postings of a file by its new index entries"""
+        self.remove_file(filename)
+        connection = self.connection
+        cursor = connection.execute("SELECT COALESCE(MAX(id), 0) FROM postings")
+        first_id = cursor.fetchone()[0] + 1
+        connection.executemany(
+            "INSERT INTO postings VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+            ((first_id + position, filename, position) + entry for position, entry in enumerate(entries)))
+        if self.has_trigram_table():
+            connection.execute("INSERT INTO postings_text (rowid, value) "
+                               "SELECT id, value FROM postings WHERE id >= ?", (first_id,))
+        connection.execute("INSERT INTO files VALUES (?, ?)", (filename, sha256))
+    
+    def commit(self):
+        self.connection.commit()
+    
+    def close(self):
+        self.connection.close()
+    
+    def search(self, search_terms):
+        """Yield the results of a search for one or many terms, in file and document order"""
+        matcher = make_matcher(search_terms)
+        columns = "p.filename, p.transition, p.function_id, p.type, p.line, p.attr_name, p.value"
+        query = matcher.fts_query() if self.has_trigram_table() else None
+        if query is not None:
+            rows = self.connection.execute(
+                f"SELECT {columns} FROM postings_text JOIN postings p ON p.id = postings_text.rowid "
+                "WHERE postings_text MATCH ? ORDER BY p.filename, p.position", (query,))
+        else:
+            rows = self.connection.execute(f"SELECT {columns} FROM postings p ORDER BY p.filename, p.position")
+        
+        for filename, transition, function_id, type_val, line, attr_name, value in rows:
+            if matcher.filtered and not matcher.accepts({
+                    'workflow': workflow_name_of(filename), 'transition': transition,
+                    'function_id': function_id, 'type': type_val}):
+                continue
+            for index in matcher.find(value):
+                if attr_name is None:
+                    content = matcher.content_of(value, index)
+                else:
+                    content = f"{attr_name}=\"{value}\""
+                yield SearchResult(workflow_name_of(filename), transition, function_id, type_val,
+                                   line, filename, content, matcher.terms[index])
+
+def update_search_index(index, manifest, decoded_paths):
+    """Bring the search index in line with the decoded files listed in the manifest.
+    
+    Files decoded in this run are already indexed; files decoded by a previous
+    run without --index are indexed from their decoded XML."""
+    indexed = index.indexed_files()
+    for filename in indexed:
+        if filename not in manifest:
+            index.remove_file(filename)
+    for filename, entry in manifest.items():
+        if indexed.get(filename) == entry['sha256'] or filename not in decoded_paths:
+            continue
+        try:
+            tree = ET.parse(decoded_paths[filename])
+        except ET.ParseError as e:
+            log(f"Error indexing {decoded_paths[filename]}: {e}", QUIET)
+            continue
+        index.replace_file(filename, entry['sha256'], collect_index_entries(tree, filename))
+        log(f"Indexed: {decoded_paths[filename]}", VERBOSE)
+    index.commit()
+
+def print_decode_statistics(stats):
+    """Print how many base64 values were decoded through each decoding path"""
+    paths = [(path, count) for path, count in stats.most_common()
+             if not path.startswith(('cache ', 'kind '))]
+    if not paths:
+        return
+    log("\nDecoded base64 values by path:")
+    for path, count in paths:
+        log(f"  {path}: {count}")
+
+def print_decode_cache_statistics(stats):
+    """Print the hit/miss statistics of the decode cache"""
+    hits = stats.get('cache hit', 0)
+    misses = stats.get('cache miss', 0)
+    if hits or misses:
+        log(f"\nDecode cache: {hits} hits, {misses} misses ({100 * hits / (hits + misses):.1f}% hit rate)")
+
+class RunProfile:
+    """Status and stage times of each file of a run, reported with --profile.
+    
+    Stage times come from STAGE_TIMES in the process doing the work; with
+    several jobs they add up the time spent in all worker processes."""
+    
+    def __init__(self):
+        self.started = datetime.now()
+        self.start_time = time.perf_counter()
+        self.files = {}
+        # Stages that are not about a single file (index search, outputs)
+        self.stages = Counter()
+    
+    def file(self, filename, size=None):
+        """Return the entry of a file, created on first use"""
+        entry = self.files.get(filename)
+        if entry is None:
+            entry = self.files[filename] = {'status': None, 'size': size, 'stages': Counter()}
+        return entry
+    
+    def add_times(self, filename, times):
+        """Add stage times to a file, or to the run itself when filename is None"""
+        if filename is None:
+            self.stages.update(times)
+        else:
+            self.file(filename)['stages'].update(times)
+    
+    def stage_totals(self):
+        totals = Counter(self.stages)
+        for entry in self.files.values():
+            totals.update(entry['stages'])
+        return totals
+    
+    def print_summary(self, decode_stats):
+        """Print the time of each stage, the slowest files and the decoded values by kind"""
+        log(f"\nProfile ({time.perf_counter() - self.start_time:.2f} s in total):", QUIET)
+        for stage, seconds in self.stage_totals().most_common():
+            log(f"  {stage}: {seconds:.3f} s", QUIET)
+        slowest = sorted(self.files.items(), key=lambda item: -sum(item[1]['stages'].values()))[:5]
+        slowest = [(filename, entry) for filename, entry in slowest if entry['stages']]
+        if slowest:
+            log("Slowest files:", QUIET)
+            for filename, entry in slowest:
+                stages = ', '.join(f"{stage} {seconds:.3f} s" for stage, seconds in entry['stages'].most_common())
+                log(f"  {filename} ({entry['status']}): {stages}", QUIET)
+        kinds = [(kind[5:], count) for kind, count in decode_stats.most_common() if kind.startswith('kind ')]
+        if kinds:
+            log("Decoded base64 values by kind:", QUIET)
+            for kind, count in kinds:
+                log(f"  {kind}: {count}", QUIET)
+    
+    def write_report(self, path, argv, decode_stats, result_count):
+        """Write the run report as JSON"""
+        report = {
+            'started': self.started.isoformat(timespec='seconds'),
+            'duration': round(time.perf_counter() - self.start_time, 6),
+            'arguments': argv,
+            'decoder_version': DECODER_VERSION,
+            'results': result_count,
+            'stages': {stage: round(seconds, 6) for stage, seconds in self.stage_totals().most_common()},
+            'files': {
+                filename: {
+                    'status': entry['status'],
+                    'size': entry['size'],
+                    'prescan': entry.get('prescan'),
+                    'stages': {stage: round(seconds, 6) for stage, seconds in entry['stages'].items()}
+                }
+                for filename, entry in self.files.items()
+            },
+            'decoded_values': {
+                'by_kind': {kind[5:]: count for kind, count in decode_stats.items() if kind.startswith('kind ')},
+                'by_path': {path: count for path, count in decode_stats.items()
+                            if not path.startswith(('cache ', 'kind '))},
+            },
+            'decode_cache': {
+                'hits': decode_stats.get('cache hit', 0),
+                'misses': decode_stats.get('cache miss', 0),
+            },
+        }
+        with open(path, 'w', encoding='utf-8') as f:
+            json.dump(report, f, indent=2)
+        log(f"Run report written to {path}", QUIET)
+
+# Written with --duplicates next to result.html
+DUPLICATES_REPORT_FILENAME = "./duplicates.json"
+# Shared payloads listed on the console, the report has them all
+DUPLICATES_SHOWN = 10
+# Estimated share of shingles two payloads need in common to be near-duplicates
+NEAR_DUPLICATE_SIMILARITY = 0.8
+
+def group_payloads(payloads):
+    """Group the payload records of each file ({filename: records}) by SHA-1, in one pass.
+    
+    Returns {sha1: group}, a group holding the length, preview and signature of
+    the payload and the list of its occurrences."""
+    groups = {}
+    for filename, records in payloads.items():
+        for digest, length, preview, signature, workflow, transition, function_id, type_val, line in records:
+            group = groups.get(digest)
+            if group is None:
+                group = groups[digest] = {'length': length, 'preview': preview, 'signature': signature,
+                                          'occurrences': []}
+            group['occurrences'].append({
+                'workflow': workflow,
+                'transition': transition,
+                'function_id': function_id,
+                'type': type_val,
+                'line': line,
+                'filename': filename
+            })
+    return groups
+
+def find_near_duplicates(groups, similarity=NEAR_DUPLICATE_SIMILARITY):
+    """Cluster the distinct payloads whose signatures show at least similarity in common.
+    
+    Each band of MINHASH_BAND_ROWS signature values is a bucket key, and only the
+    payloads sharing a bucket are compared, so the work grows with the number of
+    payloads instead of its square. Returns the clusters of several payloads, as
+    lists of SHA-1s."""
+    parents = {}
+    
+    def find(digest):
+        while parents[digest] != digest:
+            parents[digest] = parents[parents[digest]]
+            digest = parents[digest]
+        return digest
+    
+    buckets = {}
+    for digest, group in groups.items():
+        signature = group['signature']
+        if signature is None:
+            continue
+        parents[digest] = digest
+        for start in range(0, len(signature), MINHASH_BAND_ROWS):
+            buckets.setdefault((start, signature[start:start + MINHASH_BAND_ROWS]), []).append(digest)
+    
+    for members in buckets.values():
+        # Each payload is compared with one payload of each cluster already in the bucket
+        representatives = []
+        for digest in members:
+            for representative in representatives:
+                if signature_similarity(groups[digest]['signature'],
+                                        groups[representative]['signature']) >= similarity:
+                    parents[find(digest)] = find(representative)
+                    break
+            else:
+                representatives.append(digest)
+    
+    clusters = {}
+    for digest in parents:
+        clusters.setdefault(find(digest), []).append(digest)
+    return [members for members in clusters.values() if len(members) > 1]
+
+def write_duplicates_report(payloads, path, near=False):
+    """Write the payloads found in several places, and with near the near-duplicate payloads, as JSON.
+    
+    payloads holds the records of each file (see PayloadCollector). The most
+    shared payloads are also printed."""
+    groups = group_payloads(payloads)
+    
+    def workflows_of(group):
+        return sorted({occurrence['workflow'] for occurrence in group['occurrences']})
+    
+    def summary(digest, group):
+        return {
+            'sha1': digest,
+            'length': group['length'],
+            'preview': group['preview'],
+            'count': len(group['occurrences']),
+            'workflows': workflows_of(group)
+        }
+    
+    shared = [(digest, group) for digest, group in groups.items() if len(group['occurrences']) > 1]
+    shared.sort(key=lambda item: (-len(workflows_of(item[1])), -len(item[1]['occurrences']), -item[1]['length']))
+    report = {
+        'payloads': sum(len(records) for records in payloads.values()),
+        'distinct': len(groups),
+        'min_length': PAYLOAD_MIN_LENGTH,
+        'duplicates': [dict(summary(digest, group), occurrences=group['occurrences']) for digest, group in shared]
+    }
+    
+    clusters = []
+    if near:
+        for members in find_near_duplicates(groups):
+            members.sort(key=lambda digest: (-len(groups[digest]['occurrences']), digest))
+            first = groups[members[0]]['signature']
+            clusters.append([dict(summary(digest, groups[digest]),
+                                  similarity=round(signature_similarity(first, groups[digest]['signature']), 3))
+                             for digest in members])
+        clusters.sort(key=lambda cluster: -sum(payload['count'] for payload in cluster))
+        report['near_duplicate_similarity'] = NEAR_DUPLICATE_SIMILARITY
+        report['near_duplicates'] = [{'payloads': cluster} for cluster in clusters]
+    
+    with open(path, 'w', encoding='utf-8') as f:
+        json.dump(report, f, indent=2, ensure_ascii=False)
+    
+    log(f"\nDuplicate payloads: {len(shared)} of {len(groups)} distinct payloads "
+        f"(at least {PAYLOAD_MIN_LENGTH} characters) are used in several places")
+    for digest, group in shared[:DUPLICATES_SHOWN]:
+        log(f"  {len(group['occurrences'])}x in {len(workflows_of(group))} workflow(s), "
+            f"{group['length']} chars: {group['preview'][:60]}")
+    if near:
+        log(f"Near-duplicate payloads: {len(clusters)} group(s) of similar payloads "
+            f"({sum(len(cluster) for cluster in clusters)} payloads)")
+    log(f"Duplicates report written to {path}", QUIET)
+
+# Kinds of change reported by --diff, one result section each
+DIFF_CHANGES = ('added', 'removed', 'changed')
+
+def subtree_hashes(root):
+    """Return {element: digest} for every element under root, a Merkle hash of its subtree.
+    
+    The digest covers the tag, attributes and stripped text of the element and
+    the digests of its children in order: two subtrees with the same digest are
+    identical, whatever their size. Elements are hashed in reverse document
+    order, so the children of an element are always hashed before it."""
+    hashes = {}
+    for elem in reversed(list(root.iter())):
+        # XML names and values cannot contain NUL, it separates the fields
+        digest = hashlib.sha1(f"{elem.tag}\x00{sorted(elem.attrib.items())}\x00{(elem.text or '').strip()}"
+                              .encode('utf-8', 'surrogatepass'))
+        for child in elem:
+            digest.update(hashes[child])
+        hashes[elem] = digest.digest()
+    return hashes
+
+def element_key(elem):
+    """Return the key matching an element with its counterpart in the other snapshot: tag and id or name"""
+    return elem.tag, elem.get('id') or elem.get('name')
+
+def match_children(old, new, old_hashes, new_hashes):
+    """Pair the children of two elements with the same key.
+    
+    Identical subtrees are paired first, so a moved or inserted sibling does
+    not make the following ones look changed; the others are paired in order.
+    Returns (pairs in the order of the new children, new children with no
+    counterpart as (None, child)), and the old children left over."""
+    old_by_key = {}
+    for child in old:
+        old_by_key.setdefault(element_key(child), []).append(child)
+    
+    pairs = []
+    unmatched = []
+    for child in new:
+        candidates = old_by_key.get(element_key(child), [])
+        same = next((candidate for candidate in candidates if old_hashes[candidate] == new_hashes[child]), None)
+        if same is not None:
+            candidates.remove(same)
+            pairs.append([same, child])
+        else:
+            pair = [None, child]
+            pairs.append(pair)
+            unmatched.append(pair)
+    for pair in unmatched:
+        candidates = old_by_key.get(element_key(pair[1]))
+        if candidates:
+            pair[0] = candidates.pop(0)
+    
+    matched = {id(pair[0]) for pair in pairs if pair[0] is not None}
+    return pairs, [child for child in old if id(child) not in matched]
+
+def describe_change(old, new):
+    """Return the content of a changed value: a line diff for multi-line values, old -> new otherwise"""
+    if '\n' in old or '\n' in new:
+        lines = difflib.unified_diff(old.splitlines(), new.splitlines(), lineterm='', n=1)
+        # Skip the ---/+++ header
+        return '\n'.join(list(lines)[2:])
+    return f'"{old}" -> "{new}"'
+
+def describe_element(elem):
+    """Decode an added or removed element and its subtree, and return its XML as the content of the change.
+    
+    The context attributes of elem are already decoded (see diff_trees)."""
+    decode_element(elem, skip=CONTEXT_ATTRIBUTES)
+    for child in elem:
+        process_xml_element(child)
+    return ET.tostring(elem, encoding='unicode').strip()
+
+def diff_trees(old_tree, new_tree, filename):
+    """Yield the changes between two snapshots of a workflow, at the decoded level, as SearchResult records.
+    
+    The trees are parsed but not decoded. Identical raw subtrees decode to
+    identical values, so subtrees with equal hashes (see subtree_hashes) are
+    skipped without being visited or decoded: only the changed regions are
+    walked, and decoded as in search_raw_file (the context attributes of an
+    element first, to match it with its counterpart, then the rest when it is
+    compared). The term of a record is one of DIFF_CHANGES and its context is
+    the one of the changed element."""
+    workflow_name = workflow_name_of(filename)
+    old_hashes = subtree_hashes(old_tree.getroot())
+    new_hashes = subtree_hashes(new_tree.getroot())
+    decode_attributes(old_tree.getroot(), CONTEXT_ATTRIBUTES)
+    decode_attributes(new_tree.getroot(), CONTEXT_ATTRIBUTES)
+    paths = {}
+    
+    def result(elem, context, line, content, change):
+        return SearchResult.from_context(context_result(elem, context, workflow_name), line, filename, content, change)
+    
+    # Elements to walk as (old, new, parent path, parent context), or finished results
+    stack = [(old_tree.getroot(), new_tree.getroot(), "", ROOT_CONTEXT)]
+    while stack:
+        item = stack.pop()
+        if isinstance(item, SearchResult):
+            yield item
+            continue
+        old, new, path, parent_context = item
+        if old_hashes[old] == new_hashes[new]:
+            continue
+        current_path = child_path(paths, path, new.tag)
+        context = element_context(new, parent_context)
+        decode_element(old, skip=CONTEXT_ATTRIBUTES)
+        decode_element(new, skip=CONTEXT_ATTRIBUTES)
+        
+        for attr_name in sorted(set(old.attrib) | set(new.attrib)):
+            old_value, new_value = old.get(attr_name), new.get(attr_name)
+            if old_value != new_value:
+                yield result(new, context, f"{current_path}/@{attr_name}",
+                             describe_change(old_value or '', new_value or ''), 'changed')
+        old_text, new_text = (old.text or '').strip(), (new.text or '').strip()
+        if old_text != new_text:
+            yield result(new, context, current_path, describe_change(old_text, new_text), 'changed')
+        
+        for child in old:
+            decode_attributes(child, CONTEXT_ATTRIBUTES)
+        for child in new:
+            decode_attributes(child, CONTEXT_ATTRIBUTES)
+        pairs, removed = match_children(old, new, old_hashes, new_hashes)
+        items = []
+        for old_child, new_child in pairs:
+            if old_child is None:
+                items.append(result(new_child, element_context(new_child, context),
+                                    child_path(paths, current_path, new_child.tag),
+                                    describe_element(new_child), 'added'))
+            elif old_hashes[old_child] != new_hashes[new_child]:
+                items.append((old_child, new_child, current_path, context))
+        for old_child in removed:
+            items.append(result(old_child, element_context(old_child, context),
+                                child_path(paths, current_path, old_child.tag),
+                                describe_element(old_child), 'removed'))
+        # Children are pushed in reverse to be reported in document order
+        stack.extend(reversed(items))
+
+def parse_input(source):
+    """Parse an input (see list_inputs) without decoding it"""
+    with open_input(source) as f:
+        return ET.parse(f)
+
+def diff_exports(old_dir, new_dir):
+    """Compare two export folders workflow by workflow, at the decoded level.
+    
+    Yields (name, status, changes) for every workflow of either folder, in name
+    order, status being 'unchanged', 'changed', 'added', 'removed' or 'failed'
+    (reported, the other workflows are still compared). Inputs with the same
+    SHA-256 are unchanged without being parsed; the others are compared with
+    diff_trees. changes lists SearchResult records (a single one for an added
+    or removed workflow)."""
+    old_inputs = list_inputs(old_dir)
+    new_inputs = list_inputs(new_dir)
+    for name in sorted(set(old_inputs) | set(new_inputs)):
+        if name not in new_inputs:
+            yield name, 'removed', [SearchResult(workflow_name_of(name), 'N/A', 'N/A', 'workflow', '', name,
+                                                 input_label(old_inputs[name]), 'removed')]
+        elif name not in old_inputs:
+            yield name, 'added', [SearchResult(workflow_name_of(name), 'N/A', 'N/A', 'workflow', '', name,
+                                               input_label(new_inputs[name]), 'added')]
+        else:
+            try:
+                if hash_input(old_inputs[name]) == hash_input(new_inputs[name]):
+                    changes = []
+                else:
+                    changes = list(diff_trees(parse_input(old_inputs[name]), parse_input(new_inputs[name]), name))
+            except (ET.ParseError,) + INPUT_ERRORS as e:
+                log(f"Error comparing {name}: {e}", QUIET)
+                yield name, 'failed', []
+                continue
+            yield name, 'changed' if changes else 'unchanged', changes
+
+def run_diff(args):
+    """Compare the export folders of --diff and write the changes like search results"""
+    old_dir, new_dir = args.diff
+    for folder in args.diff:
+        if not os.path.isdir(folder):
+            log(f"Export folder not found: {folder}", QUIET)
+            return
+    
+    log(f"Comparing {old_dir} with {new_dir}...")
+    log("-"*50)
+    sinks = open_result_sinks(args.formats or ['html'], list(DIFF_CHANGES), args.render)
+    statuses = Counter()
+    change_count = 0
+    for name, status, changes in diff_exports(old_dir, new_dir):
+        statuses[status] += 1
+        if status != 'unchanged':
+            log(f"  {name}: {status}" + (f", {len(changes)} change(s)" if status == 'changed' else ''))
+        for change in changes:
+            log(f"    {change.term} {change.transition} / {change.function_id} / {change.type}: {change.line}", VERBOSE)
+            for sink in sinks:
+                sink.write(change)
+        for sink in sinks:
+            sink.flush()
+        change_count += len(changes)
+    
+    with timed('results'):
+        for sink in sinks:
+            sink.close()
+    log(f"\nCompared {sum(statuses.values())} workflows: "
+        + ', '.join(f"{count} {status}" for status, count in statuses.most_common())
+        + f"; {change_count} change(s)")
+
+def read_terms_file(path):
+    """Read search terms from a file, one per line, skipping blank lines and # comments"""
+    with open(path, 'r', encoding='utf-8') as f:
+        return [line.strip() for line in f if line.strip() and not line.lstrip().startswith('#')]
+
+# Returned by decode_inputs: decoded paths by input name, then sets of input names
+# (streamed: searched while decoding, undecoded: left to the search by --lazy)
+DecodedInputs = namedtuple('DecodedInputs', ['decoded_paths', 'failed_files', 'streamed_files', 'decode_stats',
+                                             'undecoded_files'])
+
+def decode_inputs(output_dir, inputs, manifest, args, matcher=None, index=None, profile=None, payloads=None,
+                  on_results=None):
+    """Decode the inputs (see list_inputs) that changed since the last run and update the manifest and index"""
+    remove_stale_outputs(output_dir, manifest, inputs)
+    
+    # Reuse the decoded output of unchanged files
+    decoded_paths = {}
+    tasks = []
+    cached_count = 0
+    undecoded_files = set()
+    failed_files = set()
+    for xml_file, source in inputs.items():
+        try:
+            output_path = output_path_of(output_dir, xml_file)
+        except ValueError as e:
+            log(f"Error processing {input_label(source)}: {e}", QUIET)
+            manifest.pop(xml_file, None)
+            failed_files.add(xml_file)
+            continue
+        decoded_paths[xml_file] = get_decoded_path(output_path)
+        
+        if profile:
+            profile.file(xml_file, source[2])
+        if not args.duplicates and is_cached(source, decoded_paths[xml_file], manifest.get(xml_file)):
+            cached_count += 1
+            if profile:
+                profile.file(xml_file)['status'] = 'cached'
+        elif args.lazy:
+            # Left to search_raw_file
+            manifest.pop(xml_file, None)
+            undecoded_files.add(xml_file)
+            if profile:
+                profile.file(xml_file)['status'] = 'lazy'
+        else:
+            manifest.pop(xml_file, None)
+            os.makedirs(os.path.dirname(output_path), exist_ok=True)
+            # With --stream and no index, files are searched while they are decoded
+            stream_matcher = matcher if args.stream and not args.index else None
+            duplicates = ('near' if args.near_duplicates else 'exact') if args.duplicates else None
+            tasks.append((xml_file, source, output_path, stream_matcher, args.stream, args.index, duplicates))
+    
+    # Identical payloads are decoded once, also across runs with --decode-cache
+    cache_path = os.path.join(output_dir, DECODE_CACHE_FILENAME) if args.decode_cache else None
+    if cache_path and tasks:
+        DECODE_CACHE.load(cache_path)
+    
+    # Decode changed files, in parallel when more than one job is allowed
+    streamed_files = set()
+    decode_stats = Counter()
+    progress = Progress("Decoding", len(tasks))
+    for (xml_file, source, _, _, _, _, _), outcome in decode_files(tasks, args.jobs, cache_path):
+        progress.advance()
+        decode_stats.update(outcome['stats'])
+        DECODE_CACHE.merge(outcome['cache'])
+        if profile:
+            profile.add_times(xml_file, outcome['times'])
+            profile.file(xml_file)['status'] = 'failed' if outcome['error'] else 'decoded'
+        if outcome['error'] is None:
+            log(f"Processed: {input_label(source)} -> {decoded_paths[xml_file]}", VERBOSE)
+            manifest[xml_file] = make_manifest_entry(source, output_dir, decoded_paths[xml_file], outcome['sha256'])
+            if outcome['results'] is not None:
+                # Results go out as soon as each file is done, in input order
+                streamed_files.add(xml_file)
+                if on_results:
+                    on_results(xml_file, outcome['results'])
+            if index:
+                index.replace_file(xml_file, manifest[xml_file]['sha256'], outcome['index'])
+            # Payload records of the duplicates report, {name: records}
+            if payloads is not None and outcome['payloads'] is not None:
+                payloads[xml_file] = outcome['payloads']
+        else:
+            log(f"Error processing {input_label(source)}: {outcome['error']}", QUIET)
+            failed_files.add(xml_file)
+    
+    save_manifest(output_dir, manifest)
+    if cache_path and tasks:
+        DECODE_CACHE.save(cache_path)
+    
+    if index:
+        update_search_index(index, manifest, decoded_paths)
+    
+    log(f"\nProcessed {len(inputs) - len(failed_files) - len(undecoded_files)} files successfully.")
+    if cached_count:
+        log(f"Reused {cached_count} unchanged files from {output_dir} (use --rebuild to force a full decode).")
+    if undecoded_files:
+        log(f"{len(undecoded_files)} changed files will be decoded lazily by the search (--lazy).")
+    print_decode_statistics(decode_stats)
+    return DecodedInputs(decoded_paths, failed_files, streamed_files, decode_stats, undecoded_files)
+
+SEARCH_FORM_PAGE = """<!DOCTYPE html>
+<html lang="en">
+<head>
+    <meta charset="UTF-8">
+    <title>Jira Workflow Search</title>
+</head>
+<body style="font-family: Arial, sans-serif; margin: 20px; background-color: #f5f5f5;">
+    <h2>Jira Workflow Search</h2>
+    <form action="/search">
+        <input type="hidden" name="format" value="html">
+        <input type="text" name="q" placeholder="Search term" autofocus>
+        <button type="submit">Search</button>
+    </form>
+</body>
+</html>
+"""
+
+SEARCH_API_USAGE = "Usage: /search?q=<term>[&q=<term>...] or /search?query=<query>, [&format=json|html][&all=1]\n"
+
+class SearchRequestHandler(BaseHTTPRequestHandler):
+    """Answer the requests of the --serve search API.
+    
+    GET / returns a search form, GET /search?q=<term> the results as JSON
+    (format=json, the default) or as the result.html page (format=html).
+    Several q parameters search several terms at once, query=<query> runs
+    a Query instead; all=1 reports every hit instead of collapsing identical
+    ones."""
+    
+    def do_GET(self):
+        url = urlparse(self.path)
+        params = parse_qs(url.query)
+        if url.path == '/':
+            self.send_text(200, 'text/html', SEARCH_FORM_PAGE)
+            return
+        if url.path != '/search':
+            self.send_text(404, 'text/plain', "Not found\n")
+            return
+        
+        terms = list(dict.fromkeys(term for term in params.get('q', []) if term))
+        result_format = params.get('format', ['json'])[0]
+        if not (terms or params.get('query')) or result_format not in ('json', 'html'):
+            self.send_text(400, 'text/plain', SEARCH_API_USAGE)
+            return
+        
+        if params.get('query'):
+            try:
+                matcher = Query(params['query'][0])
+            except (ValueError, re.error) as e:
+                self.send_text(400, 'text/plain', f"Invalid query: {e}\n")
+                return
+        else:
+            matcher = make_matcher(terms)
+        results = self.server.index.search(matcher)
+        if params.get('all', ['0'])[0] not in ('1', 'true'):
+            results = group_results(results)
+        
+        page = io.StringIO()
+        if result_format == 'html':
+            spool = ResultSpool(results)
+            write_results_page(page, matcher.terms, spool, self.server.render)
+            spool.close()
+            self.send_text(200, 'text/html', page.getvalue())
+        else:
+            results = [result.as_dict() for result in results]
+            json.dump({'terms': matcher.terms, 'count': len(results), 'results': results},
+                      page, ensure_ascii=False)
+            self.send_text(200, 'application/json', page.getvalue())
+    
+    def log_message(self, format, *args):
+        # Requests are logged like the rest of the output, only with -v
+        log(f"{self.address_string()} - {format % args}", VERBOSE)
+    
+    def send_text(self, status, content_type, text):
+        body = text.encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', f"{content_type}; charset=utf-8")
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+class SearchServer(HTTPServer):
+    """HTTP server of the search API, listening on localhost only"""
+    
+    def __init__(self, port, index, render='auto'):
+        super().__init__(('127.0.0.1', port), SearchRequestHandler)
+        self.index = index
+        self.render = render
+        # handle_request() returns after this long without requests
+        self.timeout = WATCH_INTERVAL
+
+def serve(args, input_dir, output_dir, manifest):
+    """Keep the decoded files and the search index warm and answer searches over HTTP.
+    
+    Requests are handled one at a time in the main thread. Between requests,
+    ./xml is checked for changed exports every WATCH_INTERVAL seconds and only
+    the changed files are decoded and indexed again."""
+    # Searches are always answered from the index
+    args.index = True
+    index = SearchIndex(os.path.join(output_dir, SEARCH_INDEX_FILENAME))
+    server = SearchServer(args.port, index, args.render)
+    
+    # The sources hold the size and mtime of every input
+    snapshot = list_inputs(input_dir)
+    decode_inputs(output_dir, snapshot, manifest, args, index=index)
+    log(f"\nServing searches on http://127.0.0.1:{args.port}/ (press Ctrl+C to stop)", QUIET)
+    log(f"Watching {input_dir} for changed XML files.")
+    
+    next_check = time.monotonic() + WATCH_INTERVAL
+    try:
+        while True:
+            sys.stdout.flush()
+            server.handle_request()
+            if time.monotonic() < next_check:
+                continue
+            current = list_inputs(input_dir)
+            if current != snapshot:
+                log(f"\nChanges detected in {input_dir}, updating the decoded files...")
+                snapshot = current
+                decode_inputs(output_dir, snapshot, manifest, args, index=index)
+            next_check = time.monotonic() + WATCH_INTERVAL
+    except KeyboardInterrupt:
+        log("\nServer stopped.", QUIET)
+    finally:
+        server.server_close()
+        index.close()
+
+def parse_query(text):
+    """Build the Query of a --query argument"""
+    try:
+        return Query(text)
+    except (ValueError, re.error) as e:
+        raise argparse.ArgumentTypeError(f"invalid query {text!r}: {e}")
+
+def parse_arguments(argv=None):
+    """Parse command line arguments"""
+    parser = argparse.ArgumentParser(
+        description="Decode Base64 content in Jira workflow XML files and search the decoded workflows.")
+    parser.add_argument('search_terms', nargs='*', metavar='search_term',
+                        help="terms to search for (case-insensitive), all matched in a single pass")
+    parser.add_argument('-f', '--terms-file',
+                        help="file with additional search terms, one per line (# starts a comment)")
+    parser.add_argument('--query', type=parse_query,
+                        help="search with a query instead of terms: words, /regexes/ and field filters "
+                             f"such as type:FIELD_EMAIL_TEMPLATE or function_id:/ScriptRunner/ "
+                             f"(fields: {', '.join(QUERY_FIELDS)})")
+    parser.add_argument('--rebuild', action='store_true',
+                        help="ignore the decode cache and re-decode every XML file")
+    parser.add_argument('-j', '--jobs', type=int, default=os.cpu_count() or 1,
+                        help="number of worker processes used for decoding (default: number of CPU cores)")
+    parser.add_argument('--stream', action='store_true',
+                        help="decode and search each file in a single streaming pass with bounded memory")
+    parser.add_argument('--index', action='store_true',
+                        help="maintain a search index in xml-decoded and answer searches from it without parsing XML")
+    parser.add_argument('--render', choices=['auto', 'table', 'paged'], default='auto',
+                        help="result.html layout: static table, paged table rendered in the browser with "
+                             f"filters, or auto (paged above {STATIC_TABLE_LIMIT} results)")
+    parser.add_argument('--all-hits', action='store_true',
+                        help="report every hit instead of collapsing identical hits into one result with a count")
+    parser.add_argument('--format', dest='formats', action='append', choices=RESULT_FORMATS,
+                        help="write the results to result.<format>; repeat for several formats (default: html). "
+                             "jsonl and csv are written as results are found")
+    parser.add_argument('--duplicates', action='store_true',
+                        help=f"report the decoded scripts and templates used by several workflows or transitions "
+                             f"in {DUPLICATES_REPORT_FILENAME} (decodes every file again)")
+    parser.add_argument('--near-duplicates', action='store_true',
+                        help="like --duplicates, also grouping payloads that are nearly identical")
+    parser.add_argument('--diff', nargs=2, metavar=('OLD', 'NEW'),
+                        help="compare two export folders at the decoded level and write the added, removed and "
+                             "changed elements to result.<format> instead of searching")
+    parser.add_argument('--no-prescan', dest='prescan', action='store_false',
+                        help="parse every file for a search, instead of skipping the files whose raw bytes "
+                             "show they cannot contain a hit")
+    parser.add_argument('--lazy', action='store_true',
+                        help="search changed files without writing them to xml-decoded, decoding only the "
+                             "values the search reaches")
+    parser.add_argument('--serve', action='store_true',
+                        help="keep running: watch ./xml for changed files and answer searches over HTTP on localhost")
+    parser.add_argument('--port', type=int, default=SERVE_PORT,
+                        help=f"port of the --serve search API (default: {SERVE_PORT})")
+    verbosity = parser.add_mutually_exclusive_group()
+    verbosity.add_argument('-q', '--quiet', action='store_const', dest='log_level', const=QUIET, default=NORMAL,
+                           help="only print errors, warnings and where the results are written")
+    verbosity.add_argument('-v', '--verbose', action='store_const', dest='log_level', const=VERBOSE,
+                           help="also print every processed file and every hit")
+    parser.add_argument('--profile', action='store_true',
+                        help=f"print per-stage and per-file timings and write them to {RUN_REPORT_FILENAME}")
+    parser.add_argument('--cprofile', metavar='FILE',
+                        help="profile the run with cProfile and dump the statistics to FILE "
+                             "(main process only, use -j 1 to include the decoding)")
+    parser.add_argument('--decode-cache', action='store_true',
+                        help="keep decoded payloads in xml-decoded between runs to reuse them on the next decode")
+    args = parser.parse_args(argv)
+    if args.query and (args.search_terms or args.terms_file):
+        parser.error("search terms cannot be combined with --query")
+    if args.lazy and not (args.search_terms or args.terms_file or args.query):
+        parser.error("--lazy needs search terms or --query")
+    if args.lazy and (args.stream or args.index or args.serve):
+        parser.error("--lazy cannot be combined with --stream, --index or --serve")
+    args.duplicates = args.duplicates or args.near_duplicates
+    if args.duplicates and (args.lazy or args.serve):
+        parser.error("--duplicates cannot be combined with --lazy or --serve")
+    if args.diff and (args.search_terms or args.terms_file or args.query or args.lazy or args.serve
+                      or args.index or args.stream or args.duplicates):
+        parser.error("--diff cannot be combined with a search, --lazy, --serve, --index, --stream or --duplicates")
+    return args
+
 def main():
+    args = parse_arguments()
+    configure_output(args.log_level)
+    if not args.cprofile:
+        run(args)
+        return
+    
+    profiler = cProfile.Profile()
+    profiler.enable()
+    try:
+        run(args)
+    finally:
+        profiler.disable()
+        profiler.dump_stats(args.cprofile)
+        log(f"cProfile statistics written to {args.cprofile} (python -m pstats {args.cprofile})", QUIET)
+
+def run(args):
+    """Decode the XML files and run the search described by the command line arguments"""
+    if args.diff:
+        run_diff(args)
+        return
+    profile = RunProfile()
+    
     # Create output directory if it doesn't exist
     output_dir = "./xml-decoded"
     if not os.path.exists(output_dir):
         os.makedirs(output_dir)
-        print(f"Created output directory: {output_dir}")
+        log(f"Created output directory: {output_dir}")
+        manifest = {}
+    elif args.rebuild:
+        # The decode cache only depends on the payloads, it survives a rebuild
+        clear_output_directory(output_dir, keep=(DECODE_CACHE_FILENAME,))
+        manifest = {}
     else:
-        clear_output_directory(output_dir)
+        manifest = load_manifest(output_dir)
     
     # Create input directory if it doesn't exist
     input_dir = "./xml"
     if not os.path.exists(input_dir):
         os.makedirs(input_dir)
-        print(f"Created input directory: {input_dir}")
-        print("Please place your XML files in the ./xml directory and run the script again.")
+        log(f"Created input directory: {input_dir}", QUIET)
+        log("Please place your XML files in the ./xml directory and run the script again.", QUIET)
+        return
+    
+    if args.serve:
+        serve(args, input_dir, output_dir, manifest)
         return
     
+    # Exports are read in place: subfolders, .xml.gz files and .zip archives included
+    inputs = list_inputs(input_dir)
     # Aggiungi questa riga prima di usare xml_files
-    xml_files = [f for f in os.listdir(input_dir) if f.endswith('.xml')]
+    xml_files = list(inputs)
     
     if not xml_files:
-        print(f"No XML files found in {input_dir}")
-        print("Please place your XML files in the ./xml directory and run the script again.")
+        log(f"No XML files found in {input_dir}", QUIET)
+        log("Please place your XML files in the ./xml directory and run the script again.", QUIET)
         return
     
-    print(f"Found {len(xml_files)} XML files to process.")
+    log(f"Found {len(xml_files)} XML files to process.")
     
-    # Process each XML file
-    decoded_trees = {}
-    for xml_file in xml_files:
-        input_path = os.path.join(input_dir, xml_file)
-        output_path = os.path.join(output_dir, xml_file)
-        
-        tree = process_xml_file(input_path, output_path)
-        if tree:
-            decoded_trees[xml_file] = tree
+    # All search terms are matched in a single traversal
+    search_terms = list(args.search_terms)
+    if args.terms_file:
+        search_terms.extend(read_terms_file(args.terms_file))
+    search_terms = list(dict.fromkeys(term for term in search_terms if term))
+    if args.query:
+        matcher = args.query
+    else:
+        matcher = make_matcher(search_terms) if search_terms else None
+    
+    # The search index is updated with the entries produced while decoding
+    index = SearchIndex(os.path.join(output_dir, SEARCH_INDEX_FILENAME)) if args.index else None
+    
+    # Results are streamed to the outputs as they are found, also while decoding
+    # with --stream
+    sinks = []
+    found_in_files = {}
+    result_count = 0
+    
+    def collect(results):
+        nonlocal result_count
+        if not args.all_hits:
+            results = group_results(results)
+        count = 0
+        for result in results:
+            for sink in sinks:
+                sink.write(result)
+            count += 1
+            files = found_in_files[result.term]
+            if not files or files[-1] != result.filename:
+                files.append(result.filename)
+        for sink in sinks:
+            sink.flush()
+        result_count += count
+        return count
     
-    print(f"\nProcessed {len(decoded_trees)} files successfully.")
+    def collect_streamed(filename, results):
+        log(f"Searched {filename} while decoding: {collect(results)} result(s)", VERBOSE)
     
-    # Check if search term was provided as command line argument
-    if len(sys.argv) > 1:
-        search_term = sys.argv[1]
-        print(f"\nSearching for '{search_term}'...")
-        print("-"*50)
+    if matcher is not None:
+        sinks = open_result_sinks(args.formats or ['html'], matcher.terms, args.render)
+        found_in_files = {term: [] for term in matcher.terms}
+    
+    # Payloads are hashed while they are decoded, the report only groups the hashes
+    payloads = {} if args.duplicates else None
+    decoded_paths, failed_files, streamed_files, decode_stats, undecoded_files = decode_inputs(
+        output_dir, inputs, manifest, args, matcher, index, profile, payloads, collect_streamed)
+    if payloads is not None:
+        with timed('duplicates'):
+            write_duplicates_report(payloads, DUPLICATES_REPORT_FILENAME, near=args.near_duplicates)
+    
+    # Check if search terms were provided as command line arguments
+    if matcher is not None:
+        if len(matcher.terms) == 1:
+            log(f"\nSearching for '{matcher.terms[0]}'...")
+        else:
+            log(f"\nSearching for {len(matcher.terms)} terms: {', '.join(matcher.terms)}")
+        log("-"*50)
+        
+        if index:
+            # Answer from the index, no XML is parsed
+            with timed('search index'):
+                log(f"Searched the index: {collect(index.search(matcher))} result(s)")
+        
+        # Files left undecoded by --lazy are decoded by the search itself
+        cache_path = os.path.join(output_dir, DECODE_CACHE_FILENAME) if args.decode_cache else None
+        if undecoded_files:
+            DECODE_STATS.clear()
+            if cache_path:
+                DECODE_CACHE.load(cache_path)
+        
+        # Files whose raw bytes rule out any hit are not parsed at all
+        raw_pattern = matcher.raw_pattern() if args.prescan and not index else None
+        prescan_counts = Counter()
+        
+        # Search in the decoded files not searched while decoding, one file in memory at a time
+        progress = Progress("Searching", 0 if index else len(xml_files) - len(failed_files) - len(streamed_files))
+        for filename in xml_files:
+            if index or filename in failed_files or filename in streamed_files:
+                continue
+            progress.advance()
+            search_start = time.perf_counter()
+            if raw_pattern is not None:
+                try:
+                    if filename in undecoded_files:
+                        verdict = prescan_input(inputs[filename], raw_pattern)
+                    else:
+                        verdict = prescan_file(decoded_paths[filename], raw_pattern)
+                except OSError:
+                    verdict = PRESCAN_UNSURE
+                prescan_counts[verdict] += 1
+                profile.file(filename)['prescan'] = verdict
+                if verdict == PRESCAN_NO_HIT:
+                    log(f"\nSkipped {filename}: no possible hit", VERBOSE)
+                    profile.add_times(filename, {'prescan': time.perf_counter() - search_start})
+                    continue
+            try:
+                if filename in undecoded_files:
+                    log(f"\nSearching in {filename} (decoding lazily):", VERBOSE)
+                    with open_input(inputs[filename]) as f:
+                        results = list(search_raw_file(f, matcher, filename))
+                elif args.stream:
+                    results = stream_xml_file(decoded_paths[filename], search_term=matcher,
+                                              filename=filename, decode=False)
+                    log(f"\nSearched {filename}: {len(results)} result(s)", VERBOSE)
+                else:
+                    tree = ET.parse(decoded_paths[filename])
+                    log(f"\nSearching in {filename}:", VERBOSE)
+                    results = search_in_file(tree, matcher, filename)
+            except (ET.ParseError,) + INPUT_ERRORS as e:
+                if filename in undecoded_files:
+                    log(f"Error searching {input_label(inputs[filename])}: {e}", QUIET)
+                    continue
+                log(f"Error searching {decoded_paths[filename]}: {e}", QUIET)
+                manifest.pop(filename, None)
+                save_manifest(output_dir, manifest)
+                continue
+            collect(results)
+            profile.add_times(filename, {'search': time.perf_counter() - search_start})
         
-        # Search in all decoded files and collect results
-        all_results = []
-        found_in_files = []
+        if progress.done or streamed_files:
+            log(f"Searched {progress.done + len(streamed_files)} files: {result_count} result(s)")
+        if prescan_counts:
+            skipped = prescan_counts[PRESCAN_NO_HIT]
+            log(f"Pre-scan skipped {skipped} of {sum(prescan_counts.values())} files "
+                f"({100 * skipped / sum(prescan_counts.values()):.1f}%): "
+                + ', '.join(f"{verdict} {count}" for verdict, count in prescan_counts.most_common()))
         
-        for filename, tree in decoded_trees.items():
-            print(f"\nSearching in {filename}:")
-            results = search_in_file(tree, search_term, filename)
-            if results:
-                all_results.extend(results)
-                found_in_files.append(filename)
+        if undecoded_files:
+            print_decode_statistics(DECODE_STATS)
+            decode_stats.update(DECODE_STATS)
+            if cache_path:
+                DECODE_CACHE.save(cache_path)
         
-        # Write results to file
-        write_results_to_file(search_term, all_results)
+        # Write the outputs that need all the results
+        with timed('results'):
+            for sink in sinks:
+                sink.close()
         
         # Summary
-        print(f"\n{'='*50}")
-        if found_in_files:
-            print(f"Found '{search_term}' in {len(found_in_files)} file(s):")
-            for filename in found_in_files:
-                print(f"  - {filename}")
-        else:
-            print(f"'{search_term}' not found in any file.")
+        log(f"\n{'='*50}")
+        for term in matcher.terms:
+            if found_in_files[term]:
+                log(f"Found '{term}' in {len(found_in_files[term])} file(s):")
+                for filename in found_in_files[term]:
+                    log(f"  - {filename}")
+            else:
+                log(f"'{term}' not found in any file.")
     else:
-        print("\nNo search term provided. Processing complete.")
-        print("To search, run: python base64_xml_decoder.py <search_term>")
+        result_count = None
+        log("\nNo search term provided. Processing complete.")
+        log("To search, run: python base64_xml_decoder.py <search_term> [<search_term> ...]")
+    
+    print_decode_cache_statistics(decode_stats)
+    if index:
+        index.close()
+    
+    if args.profile:
+        # Search and output stages timed in this process
+        profile.add_times(None, {stage: STAGE_TIMES[stage] for stage in ('search index', 'results', 'duplicates')
+                                 if stage in STAGE_TIMES})
+        profile.print_summary(decode_stats)
+        profile.write_report(RUN_REPORT_FILENAME, sys.argv[1:], decode_stats, result_count)
 
 if __name__ == "__main__":
     main()
\ No newline at end of file
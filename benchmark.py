@@ -0,0 +1,310 @@
+import os
+import re
+import io
+import glob
+import gzip
+import base64
+import json
+import time
+import timeit
+import random
+import argparse
+import tempfile
+import contextlib
+import xml.etree.ElementTree as ET
+
+import base64_xml_decoder as decoder
+
+def legacy_is_base64(s):
+    """Version 1.0 of is_base64: uncompiled regex plus a trial decode"""
+    if isinstance(s, str):
+        if re.match(r'^[A-Za-z0-9+/=]+$', s):
+            if len(s) % 4 == 0:
+                if len(s) <= 8 and s.isalpha():
+                    return False
+                try:
+                    base64.b64decode(s, validate=True)
+                    return True
+                except:
+                    return False
+    return False
+
+def legacy_contains_base64_pattern(text):
+    """Version 1.0 of contains_base64_pattern: two uncompiled regex scans"""
+    patterns = [
+        r'`!`[A-Za-z0-9+/=]+`!`',
+        r'YCFg[A-Za-z0-9+/=]+',
+    ]
+    for pattern in patterns:
+        if re.search(pattern, text):
+            return True
+    return False
+
+def legacy_extract_and_decode_patterns(text):
+    """Version 1.0 of extract_and_decode_patterns: two re.sub passes"""
+    def replace_pattern1(match):
+        return decoder.decode_base64(match.group(1))
+
+    text = re.sub(r'`!`([A-Za-z0-9+/=]+)`!`', replace_pattern1, text)
+
+    def replace_pattern2(match):
+        return decoder.decode_base64(match.group(1))
+
+    return re.sub(r'YCFg([A-Za-z0-9+/=]+)', replace_pattern2, text)
+
+def collect_xml_values(xml_dir):
+    """Collect every element text and attribute value of the XML files in xml_dir"""
+    values = []
+    for path in sorted(glob.glob(os.path.join(xml_dir, '*.xml'))):
+        for elem in ET.parse(path).iter():
+            if elem.text and elem.text.strip():
+                values.append(elem.text.strip())
+            values.extend(elem.attrib.values())
+    return values
+
+def sample_values():
+    """Build values from the sample search results shipped with the repository.
+
+    The contents of every result-*.html page (257 hits for result-8083.html) are
+    used as plain text, base64 encoded, gzip+base64 encoded and embedded in
+    `!` and YCFg patterns, mixed with the short attribute values typical of
+    Jira exports."""
+    values = []
+    for path in sorted(glob.glob('result-*.html')):
+        with open(path, 'r', encoding='utf-8') as f:
+            match = re.search(r'const searchResultsData = (\[.*?\]);\n', f.read(), re.S)
+        if not match:
+            continue
+        for result in json.loads(match.group(1)):
+            content = result['content'].encode('utf-8')
+            encoded = base64.b64encode(content).decode('ascii')
+            values.append(result['content'])
+            values.append(encoded)
+            values.append(base64.b64encode(gzip.compress(content)).decode('ascii'))
+            values.append(f"<p>`!`{encoded}`!`</p>")
+            values.append(base64.b64encode(b'`!`' + content).decode('ascii'))
+    for value in ['1', '10', 'true', 'null', 'Done', 'class', 'AND',
+                  'com.atlassian.jira.workflow.function.issue.UpdateIssueStatusFunction',
+                  'jira.status.id', 'Create Issue']:
+        values.extend([value] * 50)
+    return values
+
+def bench(label, func, values, repeat=5):
+    """Time func over all values and print the best run.
+
+    The decode cache is emptied before each run, so repeated payloads are
+    decoded again instead of being answered from the previous run."""
+    best = min(timeit.repeat(lambda: [func(v) for v in values], setup=decoder.DECODE_CACHE.clear,
+                             number=1, repeat=repeat))
+    print(f"  {label:<40} {best * 1000:9.2f} ms  ({len(values) / best:,.0f} values/s)")
+    return best
+
+def bench_is_base64(values):
+    """Compare the legacy trial-decode classifier with the syntactic one"""
+    print("\nis_base64 classification")
+    legacy = bench("legacy (regex + trial decode)", legacy_is_base64, values)
+    current = bench("current (precompiled syntactic check)", decoder.is_base64, values)
+    print(f"  speedup: {legacy / current:.1f}x")
+
+    # Classify and decode candidates the way process_xml_element does
+    def legacy_decode(value):
+        if legacy_is_base64(value):
+            return decoder.decode_base64(value)
+
+    def current_decode(value):
+        if decoder.is_base64(value):
+            return decoder.decode_base64(value)
+
+    print("\nis_base64 + decode_base64")
+    legacy = bench("legacy (decoded twice)", legacy_decode, values)
+    current = bench("current (decoded once)", current_decode, values)
+    print(f"  speedup: {legacy / current:.1f}x")
+
+def bench_embedded_patterns(values):
+    """Compare the legacy four-pass pattern decoding with the single-pass scanner"""
+    def legacy_decode(value):
+        if legacy_contains_base64_pattern(value):
+            return legacy_extract_and_decode_patterns(value)
+
+    print("\nEmbedded `!` / YCFg patterns")
+    legacy = bench("legacy (4 regex passes)", legacy_decode, values)
+    current = bench("current (single-pass scanner)", decoder.decode_embedded_patterns, values)
+    print(f"  speedup: {legacy / current:.1f}x")
+
+# How synthetic args are encoded, in turn
+ARG_KINDS = ['plain', 'base64', 'gzip', 'embedded', 'ycfg']
+
+SYNTHETIC_CONTENTS = [
+    '<p>Request <a class="aa-summary" href="http://jira.example.local:8080/browse/{key}">{key}</a> '
+    'was updated by {user}.</p>',
+    'import com.atlassian.jira.component.ComponentAccessor\n'
+    'def issue = ComponentAccessor.issueManager.getIssueObject("{key}")\n'
+    'log.warn("Updating " + issue.key + " for {user}")',
+    'Dear {user},\n\nyour request {key} is now in progress.\n\nRegards,\nService Desk',
+    'http://172.30.3.95:8083/rest/api/2/issue/{key}',
+]
+
+def encode_arg(kind, text):
+    """Encode an arg value the way Jira exports store it"""
+    data = text.encode('utf-8')
+    if kind == 'base64':
+        return base64.b64encode(data).decode('ascii')
+    if kind == 'gzip':
+        # A fixed mtime keeps the output deterministic (gzip.compress has no mtime before 3.8)
+        buffer = io.BytesIO()
+        with gzip.GzipFile(fileobj=buffer, mode='wb', mtime=0) as f:
+            f.write(data)
+        return base64.b64encode(buffer.getvalue()).decode('ascii')
+    if kind == 'embedded':
+        return f"<div>`!`{base64.b64encode(data).decode('ascii')}`!`</div>"
+    if kind == 'ycfg':
+        # base64 of `!` followed by the payload starts with YCFg
+        return base64.b64encode(b'`!`' + data).decode('ascii')
+    return text
+
+def generate_workflow(actions=100, functions=4, args=5, seed=0):
+    """Return a synthetic Jira workflow export as an ElementTree.
+
+    The workflow has one step per five actions; each action runs `functions`
+    post-functions with `args` args each, encoded in turn as plain text,
+    base64, gzip+base64, embedded `!` pattern and YCFg pattern."""
+    rng = random.Random(seed)
+    root = ET.Element('workflow')
+    ET.SubElement(root, 'meta', name='jira.description').text = 'Synthetic workflow'
+    steps = ET.SubElement(root, 'steps')
+    arg_count = 0
+    for action_id in range(1, actions + 1):
+        step_id = str((action_id - 1) // 5 + 1)
+        if action_id % 5 == 1:
+            step = ET.SubElement(steps, 'step', id=step_id, name=f"Status {step_id}")
+            step_actions = ET.SubElement(step, 'actions')
+        action = ET.SubElement(step_actions, 'action', id=str(action_id), name=f"Transition {action_id}")
+        ET.SubElement(action, 'meta', name='jira.i18n.title').text = f"transition.{action_id}"
+        result = ET.SubElement(ET.SubElement(action, 'results'), 'unconditional-result',
+                               {'old-status': 'Not Done', 'status': 'Done', 'step': step_id})
+        post_functions = ET.SubElement(result, 'post-functions')
+        for function_index in range(functions):
+            function = ET.SubElement(post_functions, 'function', type='class')
+            ET.SubElement(function, 'arg', name='class.name').text = \
+                f"com.example.jira.workflow.function.SyntheticFunction{function_index}"
+            for arg_index in range(args):
+                content = rng.choice(SYNTHETIC_CONTENTS).format(
+                    key=f"SD-{rng.randint(1, 99999)}", user=f"user{rng.randint(1, 500)}")
+                kind = ARG_KINDS[arg_count % len(ARG_KINDS)]
+                arg_count += 1
+                arg = ET.SubElement(function, 'arg', name=f"FIELD_{kind.upper()}_{arg_index}")
+                arg.text = encode_arg(kind, content)
+    return ET.ElementTree(root)
+
+def best_time(func, setup=None, repeat=3):
+    """Return the best wall time of func over repeat runs, calling setup (untimed) before each"""
+    best = None
+    for _ in range(repeat):
+        if setup:
+            setup()
+        start = time.perf_counter()
+        func()
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best
+
+def report_stage(label, seconds, size, elements):
+    """Print the time of a stage and its throughput"""
+    print(f"  {label:<24} {seconds * 1000:9.2f} ms  {size / seconds / 1e6:8.2f} MB/s  "
+          f"{elements / seconds:12,.0f} elements/s")
+
+def bench_stages(path, search_term, repeat=3):
+    """Time each stage of the decode and search of one XML file.
+
+    Throughputs are relative to the size of the input file. The decode cache
+    is emptied before each decode so every payload is really decoded."""
+    size = os.path.getsize(path)
+    state = {}
+    work_dir = tempfile.mkdtemp()
+    output_path = os.path.join(work_dir, 'decoded.xml')
+    html_path = os.path.join(work_dir, 'result.html')
+
+    def parse():
+        state['tree'] = ET.parse(path)
+
+    def fresh_tree():
+        parse()
+        decoder.DECODE_CACHE.clear()
+
+    def search():
+        state['results'] = list(decoder.search_in_file(state['tree'], search_term, os.path.basename(path)))
+
+    parse()
+    elements = sum(1 for _ in state['tree'].iter())
+    print(f"\nStages on {os.path.basename(path)}: {size / 1e6:.2f} MB, {elements:,} elements")
+
+    # The tool prints every hit and output file, keep the report readable
+    with contextlib.redirect_stdout(io.StringIO()):
+        timings = [("parse", best_time(parse, repeat=repeat))]
+        timings.append(("process_xml_element", best_time(
+            lambda: decoder.process_xml_element(state['tree'].getroot()), fresh_tree, repeat)))
+        timings.append(("tree.write", best_time(
+            lambda: state['tree'].write(output_path, encoding='UTF-8', xml_declaration=True), repeat=repeat)))
+        timings.append(("search_in_file", best_time(search, repeat=repeat)))
+        timings.append(("write_results_to_file", best_time(
+            lambda: decoder.write_results_to_file(search_term, state['results'], filename=html_path),
+            repeat=repeat)))
+
+    for label, seconds in timings:
+        report_stage(label, seconds, size, elements)
+    report_stage("total", sum(seconds for _, seconds in timings), size, elements)
+    print(f"  {len(state['results'])} results for '{search_term}'")
+
+    os.remove(output_path)
+    os.remove(html_path)
+    os.rmdir(work_dir)
+
+def bench_synthetic(args):
+    """Generate a synthetic workflow export and time each stage on it"""
+    print(f"Synthetic workflow: {args.actions} actions x {args.functions} post-functions x {args.args} args")
+    tree = generate_workflow(args.actions, args.functions, args.args, args.seed)
+    path = args.save
+    if path is None:
+        handle, path = tempfile.mkstemp(suffix='.xml')
+        os.close(handle)
+    tree.write(path, encoding='UTF-8', xml_declaration=True)
+    try:
+        bench_stages(path, args.term, args.repeat)
+    finally:
+        if args.save is None:
+            os.remove(path)
+
+def parse_arguments():
+    """Parse command line arguments"""
+    parser = argparse.ArgumentParser(description="Benchmark the decoder.")
+    parser.add_argument('xml_dir', nargs='?', default="./xml",
+                        help="XML files whose values are used by the value benchmarks (default: ./xml)")
+    parser.add_argument('--synthetic', action='store_true',
+                        help="time each stage on a generated workflow instead of running the value benchmarks")
+    parser.add_argument('--actions', type=int, default=100, help="actions of the generated workflow")
+    parser.add_argument('--functions', type=int, default=4, help="post-functions per action")
+    parser.add_argument('--args', type=int, default=5, help="encoded args per post-function")
+    parser.add_argument('--seed', type=int, default=0, help="seed of the generated contents")
+    parser.add_argument('--term', default="8080", help="search term of the search stages")
+    parser.add_argument('--repeat', type=int, default=3, help="runs per stage, the best one is reported")
+    parser.add_argument('--save', help="also keep the generated workflow in this file")
+    return parser.parse_args()
+
+def main():
+    args = parse_arguments()
+    if args.synthetic:
+        bench_synthetic(args)
+        return
+
+    values = collect_xml_values(args.xml_dir)
+    if values:
+        print(f"Benchmarking {len(values)} values from {args.xml_dir}")
+    else:
+        values = sample_values()
+        print(f"No XML files in {args.xml_dir}, benchmarking {len(values)} values built from the sample search results")
+
+    bench_is_base64(values)
+    bench_embedded_patterns(values)
+
+if __name__ == "__main__":
+    main()